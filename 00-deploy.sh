@@ -28,6 +28,18 @@ download_ffmpeg(){
     read -p "Do you wish to continue? (Y/N): " confirm && [[ $confirm == [yY] || $confirm == [yY][eE][sS] ]] || exit 1
 }
 
+install_python_dependencies(){
+    echo "Installing Python dependencies for the post-production functions."
+    DEST_PATH='functions/postprod-lambda'
+    pip3 install -r $DEST_PATH/requirements.txt \
+        --platform manylinux2014_x86_64 \
+        --implementation cp \
+        --python-version 3.8 \
+        --only-binary=:all: \
+        --upgrade \
+        -t $DEST_PATH
+}
+
 mkdir -p stack.out
 
 echo "Installing JQ"
@@ -35,6 +47,8 @@ sudo yum install -y jq
 
 download_ffmpeg
 
+install_python_dependencies
+
 echo "OK, deploying the solution to your AWS account."
 
 nvm install 14.17.6
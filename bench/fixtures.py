@@ -0,0 +1,151 @@
+# Offline fixtures for the benchmarks: handler loading, synthetic media and stubbed AWS clients.
+
+import importlib
+import io
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = os.path.join(ROOT, "functions")
+SHARED_LAYER = os.path.join(FUNCTIONS, "shared-layer", "python")
+
+# what the stack sets, no AWS call is ever made
+ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "POLLY_METADATA_STORE": "bench",
+    "MediaConvertRole": "arn:aws:iam::000000000000:role/bench",
+    "Application": "VOD",
+    "MEDIACONVERT_ENDPOINT": "https://bench.mediaconvert.us-east-1.amazonaws.com",
+    "DestinationBucket": "bench",
+    # the stub answers at once, the token bucket would otherwise make the cases time its sleeps
+    "MEDIACONVERT_MAX_RATE": "1000000",
+    "METRICS_ENABLED": "false",
+    "LOG_SAMPLE_RATE": "0",
+}
+
+# handler module -> function directory
+MODULES = {
+    "fadeout": "postprod-lambda",
+    "images": "postprod-lambda",
+    "video": "video-lambda",
+    "finalize": "finalize-lambda",
+}
+
+def function_path(module):
+    return os.path.join(FUNCTIONS, MODULES[module])
+
+def load(module):
+    # imports a handler like Lambda does: its own directory and the shared layer on the path,
+    # its directory as working directory so ./bin/ffmpeg resolves
+    for key, value in ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    for path in (SHARED_LAYER, function_path(module)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    os.chdir(function_path(module))
+    return importlib.import_module(module)
+
+def has_ffmpeg():
+    return os.access(os.path.join(FUNCTIONS, "postprod-lambda", "bin", "ffmpeg"), os.X_OK)
+
+def has_ffprobe():
+    return os.access(os.path.join(FUNCTIONS, "postprod-lambda", "bin", "ffprobe"), os.X_OK)
+
+def make_mp3(path, seconds):
+    # constant bitrate MPEG-1 layer III, 128 kbps 44.1 kHz stereo, silent frames behind an ID3v2 tag
+    frame = bytes([0xFF, 0xFB, 0x90, 0x00]) + bytes(413)
+    frames = int(seconds * 44100 / 1152)
+    id3 = b"ID3" + bytes([3, 0, 0, 0, 0, 0, 10]) + bytes(10)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fp:
+        fp.write(id3 + frame * frames)
+    return path
+
+def make_jpeg(path, width, height):
+    # a gradient photo, None when Pillow isn't installed
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    image.save(path, format="JPEG", quality=85)
+    return path
+
+def s3_record(bucket, key):
+    return {"s3": {"bucket": {"name": bucket}, "object": {"key": key}}}
+
+def video_trigger(asset_id, images=4, duration="187.4"):
+    # a compact trigger, as written by ImagesLambda
+    return {
+        "Version": 2,
+        "Bucket": "bench",
+        "Key": f"video-trigger/{asset_id}",
+        "AssetId": asset_id,
+        "Metadata": {
+            "AudioPreview": f"s3://bench/audio/preview/{asset_id}/narration.wav",
+            "PostProducedImagesS3Paths": [f"s3://bench/image/cache/{i:064x}.tga" for i in range(images)],
+            "FullNarration": f"s3://bench/audio/full/{asset_id}/narration.mp3",
+            "FullNarrationDurationInSeconds": duration,
+        },
+        "ArticleBody": {
+            "ImagePositions": [i * 900 for i in range(images)],
+            "TextLength": images * 1000,
+        },
+    }
+
+class StubS3:
+    # objects live in a dict, every call answers immediately
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self.objects[(Bucket, Key)]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def download_fileobj(self, Bucket, Key, Fileobj):
+        Fileobj.write(self.objects[(Bucket, Key)])
+
+    def upload_file(self, Filename, Bucket, Key):
+        pass
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+        Fileobj.read()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+class StubDynamoDB:
+    def update_item(self, **kwargs):
+        return {"Attributes": dict(kwargs["Key"])}
+
+class StubMediaConvert:
+    def describe_endpoints(self):
+        return {"Endpoints": [{"Url": ENVIRONMENT["MEDIACONVERT_ENDPOINT"]}]}
+
+    def create_job(self, **request):
+        return {"Job": {"Id": "bench", "Status": "SUBMITTED"}}
+
+def install_stubs(s3=None, dynamodb=None, mediaconvert=None):
+    # every client the handlers create through clients.py is a stub from now on
+    import clients
+    stubs = {
+        "s3": s3 or StubS3(),
+        "dynamodb": dynamodb or StubDynamoDB(),
+        "mediaconvert": mediaconvert or StubMediaConvert(),
+    }
+    clients._clients.clear()
+    clients.create = lambda service_name, **kwargs: stubs[service_name]
+    return stubs
+
+def to_json_bytes(obj):
+    return json.dumps(obj).encode("utf-8")
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+# End-to-end load generator: drives the real fadeout, images, video and finalize handlers locally.
+#
+#   S3 and DynamoDB are in-memory stand-ins, every object written to the S3 stand-in is
+#   notified to the handlers whose prefix/suffix filters match, like the S3 event sources of
+#   lib/polly-preview-simple-stack.ts
+#   MediaConvert is a fake that records create_job and "renders" the outputs of each job
+#   image hosts are a local HTTP server
+#
+# Articles are injected at --rate as if Polly had just written their full narration, each
+# function pulls up to --batch-size records per invocation with --concurrency invocations at once.
+# Reports throughput, handler latency percentiles per function and end-to-end article latency.
+#
+# fadeout runs the real ffmpeg: download it first with 00-deploy.sh, or point --ffmpeg-dir to it.
+#
+# usage: python3 bench/loadgen.py [--articles 50] [--rate 5] [--batch-size 10] [--concurrency 4]
+
+import argparse
+import io
+import json
+import os
+import queue
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fixtures
+
+BUCKET = "loadgen-asset-store"
+TABLE = "loadgen-metadata-store"
+
+# what the stack sets on the functions
+ENVIRONMENT = {
+    "POLLY_METADATA_STORE": TABLE,
+    "DestinationBucket": BUCKET,
+    "FADEOUT_RANGED_DOWNLOAD": "true",
+    "PREVIEW_FORMAT": "wav",
+    "PREVIEW_STREAMING": "false",
+    "IMAGES_MAX_COUNT": "4",
+    "TEMPLATE_S3_URL": f"s3://{BUCKET}/custom/template/template.mov",
+    "TEMPLATE_S3_URL_PREVIEW": f"s3://{BUCKET}/custom/template/Template_video_right.mov",
+}
+
+# function -> (prefix, suffix) of its S3 event sources
+NOTIFICATIONS = {
+    "fadeout": [("audio/full", "mp3")],
+    "images": [("audio/preview", "wav")],
+    "video": [("video-trigger", "json")],
+    "finalize": [("output/preview", "mp4"), ("output/full/hls", "m3u8")],
+}
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+def client_error(code, operation):
+    from botocore.exceptions import ClientError
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+class StandInS3:
+    # objects in memory, every write is notified like an s3:ObjectCreated event
+    def __init__(self, latency, on_created):
+        self.objects = {}
+        self.latency = latency
+        self.on_created = on_created
+        self.lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _put(self, bucket, key, data):
+        self._wait()
+        with self.lock:
+            self.objects[(bucket, key)] = data
+        self.on_created(bucket, key)
+
+    def _get(self, bucket, key, operation):
+        self._wait()
+        with self.lock:
+            if (bucket, key) not in self.objects:
+                raise client_error("404" if operation == "HeadObject" else "NoSuchKey", operation)
+            return self.objects[(bucket, key)]
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self._get(Bucket, Key, "GetObject")
+        response = {"ContentLength": len(data)}
+        if Range:
+            start, end = (int(value) for value in Range[len("bytes="):].split("-"))
+            end = min(end, len(data) - 1)
+            response["ContentRange"] = f"bytes {start}-{end}/{len(data)}"
+            data = data[start:end + 1]
+        response["Body"] = io.BytesIO(data)
+        return response
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self._get(Bucket, Key, "HeadObject"))}
+
+    def download_fileobj(self, Bucket, Key, Fileobj, **kwargs):
+        Fileobj.write(self._get(Bucket, Key, "GetObject"))
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        with open(Filename, "rb") as fp:
+            self._put(Bucket, Key, fp.read())
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, **kwargs):
+        self._put(Bucket, Key, Fileobj.read())
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._put(Bucket, Key, Body if isinstance(Body, bytes) else Body.read())
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self._put(Bucket, Key, self._get(CopySource["Bucket"], CopySource["Key"], "CopyObject"))
+
+    def delete_object(self, Bucket, Key):
+        self._wait()
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+
+class StandInDynamoDB:
+    # items in memory, typed like the low-level client, with the expressions the functions use:
+    # AttributeUpdates, SET and REMOVE clauses, and =, <>, <, attribute_not_exists conditions joined by OR
+    def __init__(self, latency):
+        self.items = {}
+        self.updated_at = {}
+        self.latency = latency
+        self.lock = threading.Lock()
+
+    def _operand(self, token, item, names, values):
+        if token.startswith(":"):
+            return values[token]
+        return item.get(names.get(token, token))
+
+    def _condition(self, expression, item, names, values):
+        for term in expression.split(" OR "):
+            term = term.strip()
+            match = re.fullmatch(r"attribute_not_exists\((\S+)\)", term)
+            if match:
+                if names.get(match.group(1), match.group(1)) not in item:
+                    return True
+                continue
+            left, operator, right = term.split()
+            left = self._operand(left, item, names, values)
+            right = self._operand(right, item, names, values)
+            if (operator == "=" and left == right) or (operator == "<>" and left != right):
+                return True
+            # a comparison with a missing attribute is false, like in DynamoDB
+            if operator == "<" and left is not None and right is not None and float(left["N"]) < float(right["N"]):
+                return True
+        return False
+
+    def update_item(self, TableName, Key, AttributeUpdates=None, UpdateExpression=None,
+                    ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues=None):
+        if self.latency:
+            time.sleep(self.latency)
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        asset_id = Key["AssetId"]["S"]
+
+        with self.lock:
+            item = dict(self.items.get(asset_id, dict(Key)))
+            if ConditionExpression and not self._condition(ConditionExpression, item, names, values):
+                raise client_error("ConditionalCheckFailedException", "UpdateItem")
+
+            changed = []
+            for name, update in (AttributeUpdates or {}).items():
+                item[name] = update["Value"]
+                changed.append(name)
+            # "SET #a = :a, #b = :b REMOVE #c"
+            for action, assignments in re.findall(r"(SET|REMOVE) (.*?)(?= SET | REMOVE |$)", UpdateExpression or ""):
+                for assignment in assignments.split(","):
+                    if action == "SET":
+                        name, value = (token.strip() for token in assignment.split("="))
+                        name = names.get(name, name)
+                        item[name] = values[value]
+                        changed.append(name)
+                    else:
+                        name = assignment.strip()
+                        item.pop(names.get(name, name), None)
+
+            self.items[asset_id] = item
+            now = time.monotonic()
+            for name in changed:
+                self.updated_at.setdefault(asset_id, {})[name] = now
+
+        return {"Attributes": dict(item)} if ReturnValues == "ALL_NEW" else {}
+
+    def updated(self, asset_id, name):
+        with self.lock:
+            return self.updated_at.get(asset_id, {}).get(name)
+
+class FakeMediaConvert:
+    # records every job and writes its outputs to the S3 stand-in after --render-seconds,
+    # named like MediaConvert does: HLS children first, the master manifest last
+    def __init__(self, s3, render_seconds, latency):
+        self.s3 = s3
+        self.render_seconds = render_seconds
+        self.latency = latency
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def describe_endpoints(self):
+        return {"Endpoints": [{"Url": "https://loadgen.mediaconvert.local"}]}
+
+    def create_job(self, **request):
+        if self.latency:
+            time.sleep(self.latency)
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.jobs.append(request)
+        timer = threading.Timer(self.render_seconds, self.render, args=(request["Settings"],))
+        timer.daemon = True
+        timer.start()
+        return {"Job": {"Id": job_id, "Status": "SUBMITTED"}}
+
+    def render(self, settings):
+        basename = os.path.splitext(os.path.basename(settings["Inputs"][0]["FileInput"]))[0]
+        for output_group in settings["OutputGroups"]:
+            group_settings = output_group["OutputGroupSettings"]
+            if group_settings["Type"] == "FILE_GROUP_SETTINGS":
+                bucket, key = split_s3_path(group_settings["FileGroupSettings"]["Destination"])
+                for output in output_group["Outputs"]:
+                    self.s3.put_object(Bucket=bucket, Key=f"{key}{output.get('NameModifier', '')}.mp4", Body=b"\0" * 1024)
+            elif group_settings["Type"] == "HLS_GROUP_SETTINGS":
+                bucket, key = split_s3_path(group_settings["HlsGroupSettings"]["Destination"])
+                master = "#EXTM3U\n"
+                for output in output_group["Outputs"]:
+                    child = f"{basename}{output.get('NameModifier', '')}.m3u8"
+                    self.s3.put_object(Bucket=bucket, Key=f"{key}{child}", Body=b"#EXTM3U\n#EXTINF:10,\n")
+                    master += f"#EXT-X-STREAM-INF:BANDWIDTH=1000000\n{child}\n"
+                    if output.get("OutputSettings", {}).get("HlsSettings", {}).get("IFrameOnlyManifest") == "INCLUDE":
+                        iframes = f"{basename}{output.get('NameModifier', '')}_Iframe.m3u8"
+                        self.s3.put_object(Bucket=bucket, Key=f"{key}{iframes}", Body=b"#EXTM3U\n#EXT-X-I-FRAMES-ONLY\n")
+                        master += f'#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH=100000,URI="{iframes}"\n'
+                self.s3.put_object(Bucket=bucket, Key=f"{key}{basename}.m3u8", Body=master.encode())
+
+def split_s3_path(path):
+    bucket, _, key = path[len("s3://"):].partition("/")
+    return bucket, key
+
+class ImageHost(BaseHTTPRequestHandler):
+    # GET/HEAD /<n>.jpg from a pool of generated photos, with an ETag like a CDN would send
+    images = {}
+
+    def _respond(self, with_body):
+        name = self.path.strip("/")
+        if name not in self.images:
+            self.send_error(404)
+            return
+        data = self.images[name]
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", f'"{hash(data) & 0xffffffff:08x}"')
+        self.end_headers()
+        if with_body:
+            self.wfile.write(data)
+
+    def do_GET(self):
+        self._respond(True)
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def log_message(self, *args):
+        pass
+
+class Function:
+    # a Lambda function: a queue of S3 records and --concurrency workers invoking the handler
+    # with sqs, records are wrapped in SQS messages and the messages listed in batchItemFailures
+    # are delivered again, up to max_receives times
+    def __init__(self, name, handler, batch_size, concurrency, batch_window, sqs=False, max_receives=3):
+        self.name = name
+        self.handler = handler
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.sqs = sqs
+        self.max_receives = max_receives
+        # (s3 record, times it was received)
+        self.records = queue.Queue()
+        self.durations = []
+        self.batch_sizes = []
+        self.errors = 0
+        self.redelivered = 0
+        self.dead_lettered = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.workers = [threading.Thread(target=self.work, daemon=True) for _ in range(concurrency)]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def work(self):
+        while not self.stopped.is_set():
+            try:
+                batch = [self.records.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            if self.sqs:
+                event = {"Records": [
+                    {"eventSource": "aws:sqs", "messageId": str(i), "body": json.dumps({"Records": [record]})}
+                    for i, (record, _) in enumerate(batch)
+                ]}
+            else:
+                event = {"Records": [record for record, _ in batch]}
+
+            started = time.monotonic()
+            try:
+                response = self.handler(event, None)
+                failed = {failure["itemIdentifier"] for failure in response.get("batchItemFailures", [])}
+            except Exception as e:
+                print(f"{self.name}: {e}", file=sys.stderr)
+                with self.lock:
+                    self.errors += 1
+                failed = {str(i) for i in range(len(batch))}
+            with self.lock:
+                self.durations.append((time.monotonic() - started) * 1000)
+                self.batch_sizes.append(len(batch))
+
+            if not self.sqs:
+                continue
+            for i, (record, receives) in enumerate(batch):
+                if str(i) not in failed:
+                    continue
+                with self.lock:
+                    if receives + 1 < self.max_receives:
+                        self.redelivered += 1
+                        self.records.put((record, receives + 1))
+                    else:
+                        self.dead_lettered += 1
+
+def load_handlers():
+    os.environ.update(ENVIRONMENT)
+    return {name: fixtures.load(name).handler for name in NOTIFICATIONS}
+
+def make_article(asset_id, image_urls):
+    text = " ".join(["lorem ipsum dolor sit amet"] * 200)
+    return {
+        "AssetId": asset_id,
+        "Text": text,
+        "ImagesURLs": image_urls,
+        "ImagePositions": [i * len(text) // max(1, len(image_urls)) for i in range(len(image_urls))],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end local load generator for the Python Lambdas")
+    parser.add_argument("--articles", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=5, help="articles injected per second")
+    parser.add_argument("--batch-size", type=int, default=10, help="max S3 records per invocation")
+    parser.add_argument("--batch-window", type=float, default=0.05, help="seconds a batch waits to fill up")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent invocations per function")
+    parser.add_argument("--narration-seconds", type=float, default=180)
+    parser.add_argument("--image-pool", type=int, default=20, help="distinct photos across all articles")
+    parser.add_argument("--render-seconds", type=float, default=0.5, help="fake MediaConvert render time")
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every stand-in AWS call")
+    parser.add_argument("--ffmpeg-dir", default=os.path.join(fixtures.FUNCTIONS, "postprod-lambda", "bin"))
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sqs", action="store_true", help="deliver the S3 events through SQS queues")
+    parser.add_argument("--max-receives", type=int, default=3, help="SQS deliveries of a message before it's dead-lettered")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    if not os.access(os.path.join(args.ffmpeg_dir, "ffmpeg"), os.X_OK):
+        sys.exit(f"no ffmpeg in {args.ffmpeg_dir}: run download_ffmpeg from 00-deploy.sh or pass --ffmpeg-dir")
+
+    random.seed(args.seed)
+    latency = args.latency_ms / 1000
+    workdir = tempfile.mkdtemp(prefix="loadgen-")
+
+    # photos served by the local image host
+    for i in range(args.image_pool):
+        path = fixtures.make_jpeg(os.path.join(workdir, f"{i}.jpg"), random.randint(800, 2400), random.randint(600, 1600))
+        if path is None:
+            sys.exit("Pillow is needed to generate the photos")
+        with open(path, "rb") as fp:
+            ImageHost.images[f"{i}.jpg"] = fp.read()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHost)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    image_host = f"http://127.0.0.1:{server.server_address[1]}"
+
+    narration = fixtures.make_mp3(os.path.join(workdir, "narration.mp3"), args.narration_seconds)
+    with open(narration, "rb") as fp:
+        narration = fp.read()
+
+    functions = {}
+
+    def on_created(bucket, key):
+        for name, filters in NOTIFICATIONS.items():
+            if any(key.startswith(prefix) and key.endswith(suffix) for prefix, suffix in filters):
+                functions[name].records.put((fixtures.s3_record(bucket, key), 0))
+
+    s3 = StandInS3(latency, on_created)
+    dynamodb = StandInDynamoDB(latency)
+    mediaconvert = FakeMediaConvert(s3, args.render_seconds, latency)
+
+    os.environ["WORKSPACE_ROOT"] = os.path.join(workdir, "workspace")
+    handlers = load_handlers()
+    fixtures.install_stubs(s3=s3, dynamodb=dynamodb, mediaconvert=mediaconvert)
+
+    # handlers find ./bin/ffmpeg like in /var/task
+    os.symlink(os.path.abspath(args.ffmpeg_dir), os.path.join(workdir, "bin"))
+    os.chdir(workdir)
+
+    for name, handler in handlers.items():
+        functions[name] = Function(
+            name, handler, args.batch_size, args.concurrency, args.batch_window,
+            sqs=args.sqs, max_receives=args.max_receives
+        )
+        functions[name].start()
+
+    injected = {}
+    started = time.monotonic()
+    for i in range(args.articles):
+        asset_id = f"{uuid.UUID(int=random.getrandbits(128))}.json"
+        urls = [f"{image_host}/{random.randrange(args.image_pool)}.jpg" for _ in range(4)]
+        # what ScrapeLambda and PollyLambda leave behind for the Python functions
+        s3.objects[(BUCKET, f"text/{asset_id}")] = json.dumps(make_article(asset_id, urls)).encode()
+        injected[asset_id] = time.monotonic()
+        s3.put_object(Bucket=BUCKET, Key=f"audio/full/{asset_id}/narration.mp3", Body=narration)
+
+        next_at = started + (i + 1) / args.rate
+        time.sleep(max(0, next_at - time.monotonic()))
+
+    # an article is done when finalize recorded both its preview and its full video
+    def completed_at(asset_id):
+        preview = dynamodb.updated(asset_id, "PreviewVideoFile")
+        full = dynamodb.updated(asset_id, "FullVideoStream")
+        return max(preview, full) if preview and full else None
+
+    deadline = started + args.timeout
+    while time.monotonic() < deadline:
+        if all(completed_at(asset_id) for asset_id in injected):
+            break
+        time.sleep(0.1)
+    elapsed = time.monotonic() - started
+
+    for function in functions.values():
+        function.stopped.set()
+    server.shutdown()
+    os.chdir(fixtures.ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [
+        (completed_at(asset_id) - at) * 1000
+        for asset_id, at in injected.items() if completed_at(asset_id)
+    ]
+    report = {
+        "articles": len(injected),
+        "completed": len(latencies),
+        "elapsed_s": elapsed,
+        "throughput_articles_per_s": len(latencies) / elapsed if elapsed else 0,
+        "mediaconvert_jobs": len(mediaconvert.jobs),
+        "end_to_end_ms": percentiles(latencies),
+        "functions": {
+            name: {
+                "invocations": len(function.durations),
+                "records": sum(function.batch_sizes),
+                "mean_batch": statistics.mean(function.batch_sizes) if function.batch_sizes else 0,
+                "errors": function.errors,
+                "redelivered": function.redelivered,
+                "dead_lettered": function.dead_lettered,
+                "duration_ms": percentiles(function.durations),
+            }
+            for name, function in functions.items()
+        },
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    fmt = lambda value: "-" if value is None else f"{value:.0f}"
+    print(f"articles {report['completed']}/{report['articles']} completed in {elapsed:.1f}s, "
+          f"{report['throughput_articles_per_s']:.2f} articles/s, {report['mediaconvert_jobs']} MediaConvert jobs")
+    e2e = report["end_to_end_ms"]
+    print(f"end to end   p50 {fmt(e2e['p50'])}ms  p95 {fmt(e2e['p95'])}ms  p99 {fmt(e2e['p99'])}ms")
+    print(f"{'function':<10} {'invocations':>11} {'records':>8} {'batch':>6} {'errors':>6} {'retried':>7} {'dlq':>4} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, stats in report["functions"].items():
+        duration = stats["duration_ms"]
+        print(f"{name:<10} {stats['invocations']:>11} {stats['records']:>8} {stats['mean_batch']:>6.1f} {stats['errors']:>6} "
+              f"{stats['redelivered']:>7} {stats['dead_lettered']:>4} "
+              f"{fmt(duration['p50']):>6}ms {fmt(duration['p95']):>6}ms {fmt(duration['p99']):>6}ms")
+
+if __name__ == "__main__":
+    main()
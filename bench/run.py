@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# Microbenchmarks of the Python Lambda hot paths, offline against local fixtures and stubbed clients.
+#
+# Every case runs in its own interpreter, so peak RSS and module state don't leak between cases:
+#   latency: wall time per call over --iterations calls, after a few warm-up calls
+#   peak RSS: of the whole interpreter, handler imports included
+#   allocations: peak and net bytes traced by tracemalloc during a single call
+#
+# usage:
+#   python3 bench/run.py                  compare against bench/baselines.json
+#   python3 bench/run.py --save           record the current numbers as baselines
+#   python3 bench/run.py --check          exit 1 when a case regressed past --tolerance
+#   python3 bench/run.py --case video     only the cases whose name contains "video"
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fixtures
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+BASELINES_PATH = os.path.join(BENCH_PATH, "baselines.json")
+
+WARMUP = 3
+
+# compared against the baselines, latency is noisy so it gets more room than allocations
+METRICS = {
+    "latency_us_p50": 0.25,
+    "alloc_peak_kb": 0.10,
+}
+
+# each case returns the function to time, or None when a fixture can't be built here
+
+def case_video_jobs(workdir):
+    video = fixtures.load("video")
+    asset_id = "0f9c8a52-5d1e-4a0c-9b6e-0c1b2d3e4f50.json"
+    s3 = fixtures.StubS3({
+        ("bench", f"video-trigger/{asset_id}"): fixtures.to_json_bytes(fixtures.video_trigger(asset_id))
+    })
+    fixtures.install_stubs(s3=s3)
+    record = fixtures.s3_record("bench", f"video-trigger/{asset_id}")
+    # a fixture the handler can't use would only time its error path
+    job_output = video.create_media_convert_jobs(record)
+    if job_output["statusCode"] != 200:
+        raise RuntimeError(f"video fixture failed: {job_output['body']}")
+    return lambda: video.create_media_convert_jobs(record)
+
+def case_fadeout_duration_mp3(workdir):
+    # what fade_out runs with DURATION_ENGINE=mp3, compare with fadeout.duration_ffprobe
+    fadeout = fixtures.load("fadeout")
+    path = fixtures.make_mp3(os.path.join(workdir, "narration.mp3"), seconds=600)
+    if fadeout.get_duration_mp3(path) is None:
+        raise RuntimeError("the mp3 fixture has no readable duration")
+    return lambda: fadeout.get_duration_mp3(path)
+
+def case_fadeout_duration_ffprobe(workdir):
+    # the fallback of fade_out when neither the frame headers nor the ffmpeg banner had a duration
+    if not fixtures.has_ffprobe():
+        return None
+    fadeout = fixtures.load("fadeout")
+    path = fixtures.make_mp3(os.path.join(workdir, "narration.mp3"), seconds=600)
+    return lambda: fadeout.get_duration_ffprobe(path)
+
+def case_fadeout_fade_out(workdir):
+    if not fixtures.has_ffmpeg():
+        return None
+    fadeout = fixtures.load("fadeout")
+    fixtures.install_stubs()
+    media_object = fadeout.create_media_object(["bench", "audio/full/bench.json/narration.mp3"])
+    fadeout.create_local_paths(media_object)
+    fixtures.make_mp3(media_object["local_full_path"], seconds=180)
+
+    def run():
+        media_object["source_available"] = True
+        media_object["full_narration_duration"] = None
+        return fadeout.fade_out(media_object)
+    return run
+
+def case_images_convert_image(workdir):
+    images = fixtures.load("images")
+    if not images.transcode.is_available() and not fixtures.has_ffmpeg():
+        return None
+    source = fixtures.make_jpeg(os.path.join(workdir, "photo.jpg"), 2400, 1600)
+    if source is None:
+        return None
+    output = os.path.join(workdir, "photo.jpg.tga")
+    return lambda: images.convert_image(source, output)
+
+def case_images_create_media_object(workdir):
+    images = fixtures.load("images")
+    pair = ["bench", "audio/preview/0f9c8a52-5d1e-4a0c-9b6e-0c1b2d3e4f50.json/narration.wav"]
+    return lambda: images.create_media_object(pair)
+
+def case_fadeout_create_media_object(workdir):
+    fadeout = fixtures.load("fadeout")
+    pair = ["bench", "audio/full/0f9c8a52-5d1e-4a0c-9b6e-0c1b2d3e4f50.json/narration.mp3"]
+    return lambda: fadeout.create_media_object(pair)
+
+def case_finalize_update_metadata(workdir):
+    finalize = fixtures.load("finalize")
+    fixtures.install_stubs()
+    # a rendition set of 10 articles: preview, master and two child playlists each
+    records = []
+    for i in range(10):
+        asset = f"{i:08x}-5d1e-4a0c-9b6e-0c1b2d3e4f50"
+        records += [
+            fixtures.s3_record("bench", f"output/preview/{asset}.mp4"),
+            fixtures.s3_record("bench", f"output/full/hls/{asset}/template.m3u8"),
+            fixtures.s3_record("bench", f"output/full/hls/{asset}/template{asset}.m3u8"),
+            fixtures.s3_record("bench", f"output/full/hls/{asset}/template{asset}_1.m3u8"),
+        ]
+    return lambda: finalize.update_metadata([finalize.create_media_object(record) for record in records])
+
+# name -> (setup, default iterations)
+CASES = {
+    "video.create_media_convert_jobs": (case_video_jobs, 200),
+    "fadeout.duration_mp3": (case_fadeout_duration_mp3, 50),
+    "fadeout.duration_ffprobe": (case_fadeout_duration_ffprobe, 50),
+    "fadeout.fade_out": (case_fadeout_fade_out, 5),
+    "images.convert_image": (case_images_convert_image, 10),
+    "images.create_media_object": (case_images_create_media_object, 2000),
+    "fadeout.create_media_object": (case_fadeout_create_media_object, 2000),
+    "finalize.update_metadata": (case_finalize_update_metadata, 200),
+}
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def measure(name, iterations):
+    # runs in the child interpreter
+    setup, _ = CASES[name]
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        function = setup(workdir)
+        if function is None:
+            return {"skipped": True}
+
+        for _ in range(WARMUP):
+            function()
+
+        latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            function()
+            latencies.append((time.perf_counter() - started) * 1e6)
+
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        function()
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            "iterations": iterations,
+            "latency_us_p50": statistics.median(latencies),
+            "latency_us_p95": percentile(latencies, 0.95),
+            "latency_us_mean": statistics.mean(latencies),
+            "alloc_peak_kb": (peak - before) / 1024,
+            "alloc_net_kb": (after - before) / 1024,
+            # kilobytes on Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run_case(name, iterations):
+    # spawns the child interpreter, its last line of output is the result
+    command = [sys.executable, os.path.abspath(__file__), "--child", name]
+    if iterations:
+        command += ["--iterations", str(iterations)]
+    p = subprocess.run(command, capture_output=True, text=True)
+    if p.returncode != 0:
+        return {"error": p.stderr.strip()[-2048:]}
+    return json.loads(p.stdout.strip().splitlines()[-1])
+
+def compare(result, baseline, tolerance):
+    # [(metric, baseline, current, ratio)] of the metrics that got worse than allowed
+    regressions = []
+    for metric, default_tolerance in METRICS.items():
+        if metric not in result or metric not in baseline or baseline[metric] <= 0:
+            continue
+        ratio = result[metric] / baseline[metric]
+        if ratio > 1 + (tolerance if tolerance is not None else default_tolerance):
+            regressions.append((metric, baseline[metric], result[metric], ratio))
+    return regressions
+
+def load_baselines():
+    if not os.path.isfile(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH) as fp:
+        return json.load(fp)
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the Python Lambda hot paths")
+    parser.add_argument("--case", action="append", help="only cases whose name contains this, repeatable")
+    parser.add_argument("--iterations", type=int, help="calls per case, each case has its own default")
+    parser.add_argument("--save", action="store_true", help="write the results to bench/baselines.json")
+    parser.add_argument("--check", action="store_true", help="exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, help="allowed slowdown ratio for every metric, e.g. 0.2")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # the handlers print too, the result is the last line
+        print(json.dumps(measure(args.child, args.iterations or CASES[args.child][1])))
+        return
+
+    names = [
+        name for name in CASES
+        if not args.case or any(pattern in name for pattern in args.case)
+    ]
+    results = {name: run_case(name, args.iterations) for name in names}
+    baselines = load_baselines()
+
+    regressed = False
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'case':<34} {'p50':>10} {'p95':>10} {'alloc peak':>11} {'alloc net':>10} {'peak rss':>9}  vs baseline")
+    for name, result in results.items():
+        if args.json:
+            continue
+        if "error" in result:
+            print(f"{name:<34} error: {result['error']}")
+            regressed = True
+            continue
+        if result.get("skipped"):
+            print(f"{name:<34} skipped, fixture unavailable here")
+            continue
+
+        regressions = compare(result, baselines.get(name, {}), args.tolerance)
+        regressed = regressed or bool(regressions)
+        versus = ", ".join(f"{metric} x{ratio:.2f}" for metric, _, _, ratio in regressions) or (
+            "ok" if name in baselines else "no baseline"
+        )
+        print(
+            f"{name:<34} {result['latency_us_p50']:>8.1f}us {result['latency_us_p95']:>8.1f}us "
+            f"{result['alloc_peak_kb']:>9.1f}kB {result['alloc_net_kb']:>8.1f}kB {result['peak_rss_mb']:>7.1f}MB  {versus}"
+        )
+
+    if args.save:
+        baselines.update({
+            name: result for name, result in results.items()
+            if "error" not in result and not result.get("skipped")
+        })
+        with open(BASELINES_PATH, "w") as fp:
+            json.dump(baselines, fp, indent=2, sort_keys=True)
+            fp.write("\n")
+
+    if args.check and regressed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
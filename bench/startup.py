@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Cold start benchmark of the Python Lambda handlers.
+#
+# Every run imports a handler in a fresh interpreter, like a new Lambda container, and measures
+#   import: loading the handler module and running its module level init
+#   first client: creating the first boto3 client, which the handler pays on its first request
+#
+# usage: python3 bench/startup.py [--runs 20] [--json]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import fixtures
+
+# handler module, first client it creates
+HANDLERS = [
+    ("fadeout",  "s3"),
+    ("images",   "s3"),
+    ("video",    "s3"),
+    ("finalize", "dynamodb"),
+]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+# boto3 already loaded means something in the handler still imports it eagerly
+boto3_at_import = "boto3" in sys.modules
+import clients
+clients.client({service!r})
+created = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "first_client_ms": (created - imported) * 1000,
+    "boto3_at_import": boto3_at_import
+}}))
+"""
+
+def run_once(module, service):
+    env = dict(os.environ, **fixtures.ENVIRONMENT)
+    env["PYTHONPATH"] = os.pathsep.join([fixtures.function_path(module), fixtures.SHARED_LAYER])
+
+    p = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, service=service)],
+        cwd=fixtures.function_path(module), env=env, capture_output=True, text=True
+    )
+    if p.returncode != 0:
+        raise RuntimeError(f"{module}: {p.stderr.strip()[-2048:]}")
+    return json.loads(p.stdout.strip().splitlines()[-1])
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def bench(runs):
+    results = {}
+    for module, service in HANDLERS:
+        samples = [run_once(module, service) for _ in range(runs)]
+        imports = [sample["import_ms"] for sample in samples]
+        clients = [sample["first_client_ms"] for sample in samples]
+        results[module] = {
+            "import_ms_p50": statistics.median(imports),
+            "import_ms_p90": percentile(imports, 0.9),
+            "first_client_ms_p50": statistics.median(clients),
+            "boto3_at_import": any(sample["boto3_at_import"] for sample in samples),
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark of the Python Lambda handlers")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = bench(args.runs)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'handler':<10} {'import p50':>11} {'import p90':>11} {'1st client':>11}  boto3 at import")
+    for module, result in results.items():
+        print(
+            f"{module:<10} {result['import_ms_p50']:>9.1f}ms {result['import_ms_p90']:>9.1f}ms "
+            f"{result['first_client_ms_p50']:>9.1f}ms  {result['boto3_at_import']}"
+        )
+
+if __name__ == "__main__":
+    main()
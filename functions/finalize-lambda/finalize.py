@@ -1,19 +1,45 @@
-import boto3
 import os
-import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 
+import batch
+import clients
+import metrics
+
 try:
     POLLY_METADATA_STORE = os.environ['POLLY_METADATA_STORE']
 except KeyError as e:
     print(f"Missing env variable: {e}")
     exit(1)
 
-dynamo = boto3.resource("dynamodb")
-polly_metadata_store = dynamo.Table(POLLY_METADATA_STORE)
+# assets written concurrently, each update_item retried while throttled
+FINALIZE_MAX_WORKERS = int(os.environ.get("FINALIZE_MAX_WORKERS", 8))
+FINALIZE_MAX_ATTEMPTS = int(os.environ.get("FINALIZE_MAX_ATTEMPTS", 4))
+FINALIZE_BACKOFF = float(os.environ.get("FINALIZE_BACKOFF", 0.1))
+
+RETRYABLE_CODES = (
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "InternalServerError"
+)
+
+# confirm the playlist type by reading the head of the manifest instead of trusting its name
+FINALIZE_PLAYLIST_PROBE = os.environ.get("FINALIZE_PLAYLIST_PROBE", "false").lower() == "true"
+FINALIZE_PROBE_BYTES = int(os.environ.get("FINALIZE_PROBE_BYTES", 4096))
+
+# only master manifests list variant streams
+MASTER_PLAYLIST_TAG = b"#EXT-X-STREAM-INF"
+
+# created on first use, see clients.py in the shared layer
+s3 = clients.lazy("s3")
+polly_metadata_store = clients.table(POLLY_METADATA_STORE)
 
 def create_media_object(item):
-    # "output/full/hls/62de657b-7884-4dc0-8286-b9b63c521351/template62de657b-7884-4dc0-8286-b9b63c521351.m3u8"
+    # output/full/hls/62de657b-7884-4dc0-8286-b9b63c521351/template.m3u8 (master)
+    # output/full/hls/62de657b-7884-4dc0-8286-b9b63c521351/template62de657b-7884-4dc0-8286-b9b63c521351.m3u8 (child)
     # output/preview/62de657b-7884-4dc0-8286-b9b63c521351.mp4
     media_key = item['s3']['object']['key']
     media_type = media_key.split('/')[1]
@@ -30,67 +56,151 @@ def create_media_object(item):
         "media_id": media_id,
         "media_type": media_type,
         "media_key": media_key,
-        "media_bucket": media_bucket
+        "media_bucket": media_bucket,
+        "playlist": classify_playlist(media_bucket, media_key) if media_type == "full" else None
     }
 
+def probe_playlist(bucket, key):
+    # "master" or "child" from the first bytes of the manifest, None if it can't be read
+    try:
+        response = s3.get_object(
+            Bucket=bucket,
+            Key=key,
+            Range=f"bytes=0-{FINALIZE_PROBE_BYTES - 1}"
+        )
+        head = response["Body"].read()
+    except ClientError as e:
+        print(e)
+        return None
+    
+    return "master" if MASTER_PLAYLIST_TAG in head else "child"
+
+def classify_playlist(bucket, key):
+    # video.py sets the asset name as NameModifier of the full video outputs, so
+    # child playlists are named <input><asset>*.m3u8 and the master is just <input>.m3u8
+    parts = key.split("/")
+    playlist = None
+    
+    if len(parts) == 5:
+        asset_dir, stem = parts[3], parts[4][:-len(".m3u8")]
+        playlist = "child" if asset_dir in stem else "master"
+    
+    if FINALIZE_PLAYLIST_PROBE or playlist is None:
+        playlist = probe_playlist(bucket, key) or playlist
+    
+    return playlist
+
 def ddb_value(item):
     return {
         "Value": item
     }
 
+def is_child_playlist(media_object):
+    # only the master manifest is recorded, its children would overwrite it in any order
+    return media_object["playlist"] == "child"
+
 def is_successful_ops(media_object):
-    return media_object["metadata_updated"]
+    return media_object["metadata_updated"] or is_child_playlist(media_object)
     
 def is_failed_ops(media_object):
     return not is_successful_ops(media_object)
 
-def update_metadata(media_object):
-    
-    media_object['metadata_updated'] = False
-    
+def get_attribute_updates(media_object):
     attribute_updates = {}
     full_path = f"s3://{media_object['media_bucket']}/{media_object['media_key']}"
     
-
     if media_object['media_type'] == "preview":
         attribute_updates['PreviewVideoFile'] = ddb_value(full_path)
     if media_object['media_type'] == "full":
         attribute_updates['FullVideoStream'] = ddb_value(full_path)
+    
+    return attribute_updates
+
+def coalesce_updates(media_objects):
+    # one write per asset: updates of records for the same asset are merged,
+    # a later record overwrites the attribute of an earlier one like sequential writes did
+    # returns {asset_id: (attribute_updates, [media_object, ...])}
+    writes = {}
+    for media_object in media_objects:
+        attribute_updates = get_attribute_updates(media_object)
+        if len(attribute_updates) == 0 or media_object["media_id"] is None or is_child_playlist(media_object):
+            continue
         
-    print(attribute_updates)
-        
-    if len(attribute_updates) == 0:
-        return media_object
-        
-    asset_id = media_object["media_id"]
+        asset_updates, asset_objects = writes.setdefault(media_object["media_id"], ({}, []))
+        asset_updates.update(attribute_updates)
+        asset_objects.append(media_object)
     
-    try:
-        dynamo_response = polly_metadata_store.update_item(
-            Key={"AssetId": asset_id},
-            AttributeUpdates=attribute_updates,
+    return writes
+
+def is_retryable(error):
+    return error.response['Error']['Code'] in RETRYABLE_CODES
+
+def write_asset(asset_id, attribute_updates):
+    # single update_item, retried with jittered backoff while it's throttled
+    for attempt in range(FINALIZE_MAX_ATTEMPTS):
+        try:
+            with metrics.timer("update_metadata"):
+                polly_metadata_store.update_item(
+                    Key={"AssetId": asset_id},
+                    AttributeUpdates=attribute_updates,
+                )
+            return True
+        except ClientError as e:
+            if is_retryable(e) and attempt + 1 < FINALIZE_MAX_ATTEMPTS:
+                metrics.count("Retries", stage="update_metadata")
+                time.sleep(random.uniform(0, FINALIZE_BACKOFF * 2 ** attempt))
+                continue
+            print(e)
+            return False
+
+def update_metadata(media_objects):
+    
+    for media_object in media_objects:
+        media_object['metadata_updated'] = False
+    
+    writes = coalesce_updates(media_objects)
+    metrics.count("Writes", len(writes), stage="update_metadata")
+    metrics.log("writes", writes)
+    
+    if len(writes) == 0:
+        return media_objects
+    
+    with ThreadPoolExecutor(max_workers=min(FINALIZE_MAX_WORKERS, len(writes))) as executor:
+        results = executor.map(
+            lambda write: write_asset(write[0], write[1][0]),
+            writes.items()
         )
-        media_object["metadata_updated"] = True
-    except ClientError as e:
-        print(e)
+        
+        for (_, (_, asset_objects)), updated in zip(writes.items(), results):
+            for media_object in asset_objects:
+                media_object['metadata_updated'] = updated
     
-    return media_object
+    return media_objects
+
+def summarize(media_object):
+    return batch.summary(
+        media_object["media_key"],
+        is_successful_ops(media_object),
+        AssetId=media_object["media_id"],
+        Playlist=media_object["playlist"]
+    )
 
 def handler(event, context):
     
-    media_objects = [ create_media_object(item) for item in event['Records'] ]
-    print(media_objects)
-    updates = [ update_metadata(media_object) for media_object in media_objects ]
-    print(updates)
+    # S3 records come straight from the bucket, or wrapped in SQS messages
+    records, message_ids, unreadable = batch.unwrap(event)
+    
+    media_objects = [ create_media_object(item) for item in records ]
+    updates = update_metadata(media_objects)
     
-    successful_ops = [is_successful_ops(update) for update in updates]
     failed_ops = [ is_failed_ops(update) for update in updates]
     
-    return {
-        "statusCode":200,
-        "body": json.dumps({
-            "SuccessfulOps" : successful_ops,
-            "FailedOps": failed_ops
-            
-        }, default=str)
-    }
-    
\ No newline at end of file
+    metrics.count("Records", len(updates))
+    metrics.count("ChildPlaylists", sum(1 for update in updates if is_child_playlist(update)))
+    metrics.count("Failed", sum(failed_ops))
+    for update, failed in zip(updates, failed_ops):
+        if failed:
+            metrics.log("failed", update, always=True)
+    metrics.flush()
+    
+    return batch.response(event, message_ids, [summarize(update) for update in updates], unreadable)
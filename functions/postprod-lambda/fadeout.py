@@ -1,11 +1,18 @@
 import os
+import re
 import subprocess
 import pathlib
-import boto3
-import json
+import threading
 from botocore.exceptions import ClientError
 from decimal import Decimal
 
+import batch
+import clients
+import metrics
+import mp3
+import pipeline
+import workspace
+
 try:
     POLLY_METADATA_STORE = os.environ['POLLY_METADATA_STORE']
 except KeyError as e:
@@ -14,17 +21,98 @@ except KeyError as e:
 
 FFMPEG_PREVIEW_DURATION = int(os.environ.get("FFMPEG_PREVIEW_DURATION", 30))
 FFMPEG_FADEOUT_DURATION = int(os.environ.get("FFMPEG_FADEOUT_DURATION",  3))
+# read the narration duration from the fade-out ffmpeg run instead of a separate ffprobe
+FADEOUT_SINGLE_PASS = os.environ.get("FADEOUT_SINGLE_PASS", "true").lower() == "true"
+# "mp3" reads the duration from the frame headers in-process before ffmpeg runs, "ffprobe" skips that:
+# the duration then comes from the ffmpeg banner (FADEOUT_SINGLE_PASS), ffprobe only runs when
+# single pass is off or the banner had no duration
+DURATION_ENGINE = os.environ.get("DURATION_ENGINE", "mp3")
+
+# fetch only the leading bytes of the narration that the preview needs
+FADEOUT_RANGED_DOWNLOAD = os.environ.get("FADEOUT_RANGED_DOWNLOAD", "false").lower() == "true"
+FADEOUT_PROBE_BYTES     = int(os.environ.get("FADEOUT_PROBE_BYTES", 64 * 1024))
+FADEOUT_RANGE_MARGIN    = int(os.environ.get("FADEOUT_RANGE_MARGIN", 2))
+
+# container and codec of the audio preview, see PREVIEW_FORMATS
+PREVIEW_FORMAT    = os.environ.get("PREVIEW_FORMAT", "wav")
+# pipe the encoder output straight into a multipart upload instead of writing to /tmp
+PREVIEW_STREAMING = os.environ.get("PREVIEW_STREAMING", "false").lower() == "true"
+# streamed previews land under this prefix, which has no event notification, and are
+# copied to their final key only once ffmpeg succeeded: a partial preview never triggers ImagesLambda
+PREVIEW_STAGING_PREFIX = os.environ.get("PREVIEW_STAGING_PREFIX", "staging")
+
+# records are processed concurrently, each one running through the whole pipeline
+FADEOUT_MAX_WORKERS = int(os.environ.get("FADEOUT_MAX_WORKERS", 4))
+
+# "streamable" formats come out complete when muxed to a pipe, the others have headers
+# (RIFF sizes, STREAMINFO) that ffmpeg only fills in by seeking back: those always go through /tmp
+PREVIEW_FORMATS = {
+    "wav": {
+        "extension": "wav",
+        "content_type": "audio/wav",
+        "ffmpeg_args": ["-f", "wav"],
+        "streamable": False
+    },
+    "aac": {
+        "extension": "aac",
+        "content_type": "audio/aac",
+        "ffmpeg_args": ["-c:a", "aac", "-b:a", "96k", "-f", "adts"],
+        "streamable": True
+    },
+    "mp3": {
+        "extension": "mp3",
+        "content_type": "audio/mpeg",
+        "ffmpeg_args": ["-b:a", "96k", "-f", "mp3"],
+        "streamable": True
+    },
+    "flac": {
+        "extension": "flac",
+        "content_type": "audio/flac",
+        "ffmpeg_args": ["-f", "flac"],
+        "streamable": False
+    }
+}
+
+# what is actually streamed, PREVIEW_STREAMING is ignored for formats that can't be
+STREAM_PREVIEW = PREVIEW_STREAMING and PREVIEW_FORMATS[PREVIEW_FORMAT]["streamable"]
+
+STREAMING_CHUNK_SIZE = 8 * 1024 * 1024
 
-s3 = boto3.client("s3")
-dynamo = boto3.resource("dynamodb")
-polly_metadata_store = dynamo.Table(POLLY_METADATA_STORE)
+DURATION_PATTERN = re.compile(r"Duration:\s*(\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
 
-ROOT_PATH = "/tmp"
+# created on first use, see clients.py in the shared layer
+s3 = clients.lazy("s3")
+polly_metadata_store = clients.table(POLLY_METADATA_STORE)
 
-def default(obj):
-    if isinstance(obj, Decimal):
-        return str(obj)
-    raise TypeError("Object of type '%s' is not JSON serializable" % type(obj).__name__)
+class NarrationRecord(pipeline.MediaRecord):
+    # media_object of a full narration: its paths, what the stages produce and the pipeline checks
+    __slots__ = (
+        "s3_full_path",
+        "s3_path",
+        "s3_bucket",
+        "s3_key",
+        "media_type",
+        "media_format",
+        "media_extension",
+        "media_polly_file",
+        "media_polly_no_extension",
+        "media_document_id",
+        "workspace_path",
+        "local_path",
+        "local_full_path",
+        "local_preview_path",
+        "local_preview_full_path",
+        "preview_s3_key",
+        "preview_s3_full_path",
+        "full_narration_duration",
+        "preview_streamed",
+        "local_paths_exist",
+        "source_available",
+        "preview_available",
+        "preview_uploaded",
+        "processing_successful",
+        "metadata_updated"
+    )
 
 def create_media_object(pair):
     bucket, input_path = pair
@@ -42,7 +130,9 @@ def create_media_object(pair):
     # get anything between input_format and input_polly
     input_document = "/".join(input_split[2:-1]) 
     
-    return {
+    preview_ext = PREVIEW_FORMATS[PREVIEW_FORMAT]["extension"]
+    
+    return NarrationRecord(**{
         "s3_full_path": f"s3://{bucket}/{input_path}",
         "s3_path":f"{bucket}/{input_path}",
         "s3_bucket": bucket,
@@ -53,21 +143,24 @@ def create_media_object(pair):
         "media_polly_file": input_polly,
         "media_polly_no_extension": input_polly_no_ext,
         "media_document_id": input_document,
-        # /tmp/audio/full/$DOCUMENT_ID
-        "local_path": f"{ROOT_PATH}/{input_type}/{input_format}/{input_document}",
-        # /tmp/audio/full/$DOCUMENT_ID/$POLLY_GENERATED.mp3
-        "local_full_path": f"{ROOT_PATH}/{input_path}",
-        # /tmp/audio/preview/$DOCUMENT_ID
-        "local_preview_path": f"{ROOT_PATH}/{input_type}/preview/{input_document}",
-        # /tmp/audio/preview/$DOCUMENT_ID/$POLLY_GENERATED.wav
-        "local_preview_full_path": f"{ROOT_PATH}/{input_type}/preview/{input_document}/{input_polly_no_ext}.wav",
-        "preview_s3_key":f"{input_type}/preview/{input_document}/{input_polly_no_ext}.wav",
-        "preview_s3_full_path": f"s3://{bucket}/{input_type}/preview/{input_document}/{input_polly_no_ext}.wav"
-    }
+        "preview_s3_key":f"{input_type}/preview/{input_document}/{input_polly_no_ext}.{preview_ext}",
+        "preview_s3_full_path": f"s3://{bucket}/{input_type}/preview/{input_document}/{input_polly_no_ext}.{preview_ext}"
+    })
 
 # pipeline_check : media_object["local_paths_exist"]
 def create_local_paths(media_object):
     try:
+        # a scope of the workspace per record, released by the handler once the record is done
+        scope = workspace.open_scope(media_object["media_document_id"])
+        media_object["workspace_path"] = scope
+        # $SCOPE/full
+        media_object["local_path"] = f"{scope}/{media_object['media_format']}"
+        # $SCOPE/full/$POLLY_GENERATED.mp3
+        media_object["local_full_path"] = f"{media_object['local_path']}/{media_object['media_polly_file']}"
+        # $SCOPE/preview
+        media_object["local_preview_path"] = f"{scope}/preview"
+        # $SCOPE/preview/$POLLY_GENERATED.wav
+        media_object["local_preview_full_path"] = f"{media_object['local_preview_path']}/{media_object['preview_s3_key'].split('/')[-1]}"
         pathlib.Path(media_object["local_path"]).mkdir(parents=True, exist_ok=True)
         pathlib.Path(media_object["local_preview_path"]).mkdir(parents=True, exist_ok=True)
         media_object["local_paths_exist"] = True
@@ -75,6 +168,41 @@ def create_local_paths(media_object):
         media_object["local_paths_exist"] = False
     return media_object
 
+def get_range(bucket, key, start, end):
+    # returns (bytes, total object size) for the inclusive range start-end
+    response = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")
+    # "bytes 0-65535/1234567"
+    total_size = int(response["ContentRange"].split("/")[-1])
+    return response["Body"].read(), total_size
+
+def download_preview_range(media_object):
+    # fetches only the leading bytes that cover the preview, returns False if the
+    # object doesn't look like an mp3 we can estimate, so the caller falls back
+    bucket = media_object["s3_bucket"]
+    key = media_object["s3_key"]
+    
+    data, total_size = get_range(bucket, key, 0, FADEOUT_PROBE_BYTES - 1)
+    
+    first_frame = mp3.find_first_frame(data)
+    if first_frame is None:
+        return False
+    
+    # the local file is truncated, the duration of the whole narration comes from
+    # the Xing/VBRI header when there's one, or from the object size
+    duration = mp3.duration(data, total_size=total_size)
+    
+    # a little extra past the preview, so the fade-out is never cut short
+    needed = mp3.bytes_for_duration(first_frame, FFMPEG_PREVIEW_DURATION + FADEOUT_RANGE_MARGIN)
+    if needed > len(data) and len(data) < total_size:
+        tail, _ = get_range(bucket, key, len(data), needed - 1)
+        data += tail
+    
+    with open(media_object["local_full_path"], "wb") as fp:
+        fp.write(data)
+    
+    media_object["full_narration_duration"] = Decimal(str(round(duration, 6)))
+    return True
+
 # pipeline_check : media_object["source_available"]
 def download(media_object):
     
@@ -86,13 +214,19 @@ def download(media_object):
         key = media_object["s3_key"]
         filename = media_object["local_full_path"]
         
-        with open(filename, "wb") as fp:
-            s3.download_fileobj(bucket, key, fp)
+        if FADEOUT_RANGED_DOWNLOAD and download_preview_range(media_object):
             media_object["source_available"] = True
+        else:
+            with open(filename, "wb") as fp:
+                s3.download_fileobj(bucket, key, fp)
+                media_object["source_available"] = True
+        
+        metrics.size("Bytes", os.path.getsize(filename), stage="download")
+        workspace.charge(media_object["workspace_path"], filename)
 
     return media_object
 
-def get_duration(local_path):
+def get_duration_ffprobe(local_path):
     FFPROBE_COMMAND = [
         "./bin/ffprobe",
         "-v",
@@ -108,45 +242,159 @@ def get_duration(local_path):
     
     out, err = p.communicate()
     # because ffprobe outputs on stdout stream by default, unlike ffmpeg lol
+    
+    try:
+        return Decimal(str(float(out)))
+    except ValueError:
+        print(f"ffprobe could not read the duration of {local_path}: {out!r}")
+        return None
+
+def get_duration_mp3(local_path):
+    try:
+        duration = mp3.duration_from_file(local_path)
+    except OSError as e:
+        print(e)
+        return None
+    
+    if duration is None:
+        return None
+    return Decimal(str(round(duration, 6)))
+
+def parse_duration(ffmpeg_stderr):
+    # ffmpeg prints the input container duration in its banner,
+    # e.g. "  Duration: 00:02:13.46, start: 0.000000, bitrate: 48 kb/s"
+    match = DURATION_PATTERN.search(ffmpeg_stderr)
+    if match is None:
+        return None
+    
+    hours, minutes, seconds = match.groups()
+    return Decimal(hours) * 3600 + Decimal(minutes) * 60 + Decimal(seconds)
+
+def run_ffmpeg_to_file(command, filename_out):
+    p = subprocess.Popen(command + [filename_out], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    out, err = p.communicate()
+    # because ffmpeg outputs on error stream by default
+    err = err.decode("utf-8", errors="replace")
+    
+    return p.returncode == 0 and os.path.isfile(filename_out), err
+
+def streaming_transfer_config():
+    # boto3.s3.transfer is only imported when a preview is actually streamed
+    from boto3.s3.transfer import TransferConfig
+    return TransferConfig(multipart_chunksize=STREAMING_CHUNK_SIZE)
 
-    return Decimal(str(float(out)))
+def run_ffmpeg_to_s3(command, bucket, key):
+    # ffmpeg writes the encoded preview on stdout, which is fed to a multipart upload
+    # as it is produced: nothing touches /tmp
+    # the upload goes to a staging key without notification, the preview is only published
+    # to key, which triggers ImagesLambda, once ffmpeg exited cleanly
+    staging_key = f"{PREVIEW_STAGING_PREFIX}/{key}"
+    p = subprocess.Popen(command + ["pipe:1"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    # stderr is drained on its own thread, or ffmpeg blocks once the pipe buffer is full
+    stderr_chunks = []
+    stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(p.stderr.read()))
+    stderr_reader.start()
+    
+    staged = False
+    try:
+        s3.upload_fileobj(
+            p.stdout,
+            bucket,
+            staging_key,
+            ExtraArgs={"ContentType": PREVIEW_FORMATS[PREVIEW_FORMAT]["content_type"]},
+            Config=streaming_transfer_config()
+        )
+        staged = True
+    except ClientError as e:
+        print(e)
+    finally:
+        p.stdout.close()
+        p.wait()
+        stderr_reader.join()
+    
+    err = b"".join(stderr_chunks).decode("utf-8", errors="replace")
+    
+    uploaded = False
+    if staged:
+        try:
+            if p.returncode == 0:
+                s3.copy_object(
+                    Bucket=bucket,
+                    Key=key,
+                    CopySource={"Bucket": bucket, "Key": staging_key}
+                )
+                uploaded = True
+            s3.delete_object(Bucket=bucket, Key=staging_key)
+        except ClientError as e:
+            # a leftover staging object is harmless, the bucket expires them
+            print(e)
+    
+    return uploaded, err
 
 # pipeline_check : media_object["preview_available"]
 def fade_out(media_object):
     
     media_object["preview_available"] = False
+    media_object["preview_streamed"] = False
     
     if media_object["source_available"]:
         
         filename_in  = media_object["local_full_path"]
-        filename_out = media_object["local_preview_full_path"]
         
-        media_object['full_narration_duration'] = get_duration(filename_in)
+        # a ranged download already knows the duration of the whole narration
+        duration = media_object.get('full_narration_duration')
+        
+        if duration is None and DURATION_ENGINE == "mp3":
+            with metrics.timer("probe"):
+                duration = get_duration_mp3(filename_in)
         
         start_position = FFMPEG_PREVIEW_DURATION - FFMPEG_FADEOUT_DURATION
         
         FFMPEG_COMMAND = [
             "./bin/ffmpeg",
+            "-y",
             "-i",
             filename_in,
             # f"-af 'afade=t=out:st={start_position}:d={FFMPEG_FADEOUT_DURATION}'",
             f"-af",
             f"afade=t=out:st={start_position}:d={FFMPEG_FADEOUT_DURATION}",
             "-to",
-            str(FFMPEG_PREVIEW_DURATION),
-            filename_out
-        ]
+            str(FFMPEG_PREVIEW_DURATION)
+        ] + PREVIEW_FORMATS[PREVIEW_FORMAT]["ffmpeg_args"]
         
-        print(" ".join(FFMPEG_COMMAND))
+        metrics.log("ffmpeg", " ".join(FFMPEG_COMMAND))
         
-        p = subprocess.Popen(FFMPEG_COMMAND, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    
-        out, err = p.communicate()
-        # because ffmpeg outputs on error stream by default
-        print(err)
+        if STREAM_PREVIEW:
+            successful, err = run_ffmpeg_to_s3(
+                FFMPEG_COMMAND,
+                media_object["s3_bucket"],
+                media_object["preview_s3_key"]
+            )
+            media_object["preview_streamed"] = successful
+        else:
+            successful, err = run_ffmpeg_to_file(
+                FFMPEG_COMMAND,
+                media_object["local_preview_full_path"]
+            )
+        
+        if duration is None and FADEOUT_SINGLE_PASS:
+            # the same invocation that renders the preview also reports the full duration
+            duration = parse_duration(err)
+        
+        if duration is None:
+            with metrics.timer("probe"):
+                duration = get_duration_ffprobe(filename_in)
         
-        if os.path.isfile(filename_out):
+        media_object['full_narration_duration'] = duration
+        
+        if successful:
             media_object["preview_available"] = True
+            if not STREAM_PREVIEW:
+                workspace.charge(media_object["workspace_path"], media_object["local_preview_full_path"])
+        else:
+            metrics.log("ffmpeg", err[-metrics.LOG_MAX_CHARS:], always=True)
         
     return media_object
 
@@ -155,6 +403,11 @@ def upload(media_object):
     
     media_object["preview_uploaded"] = False
     
+    # a streamed preview was uploaded while it was being encoded
+    if media_object["preview_streamed"]:
+        media_object["preview_uploaded"] = True
+        return media_object
+    
     if media_object["preview_available"]:
     
         bucket          = media_object["s3_bucket"]
@@ -169,6 +422,7 @@ def upload(media_object):
             )
             
             media_object["preview_uploaded"] = True
+            metrics.size("Bytes", os.path.getsize(local_filename), stage="upload")
         except ClientError as e:
             print(e)
         
@@ -220,61 +474,65 @@ def update_metadata(media_object):
     
     return media_object
 
-def is_successful_ops(media_object):
-    if media_object["processing_successful"] and media_object["metadata_updated"]:
-        return media_object
-    return None
+# every stage of the pipeline, in order
+PIPELINE = [
+    create_local_paths,
+    download,
+    fade_out,
+    upload,
+    check_for_failure,
+    update_metadata
+]
 
-def is_failed_ops(media_object):
-    if not media_object["processing_successful"] or not media_object["metadata_updated"]:
-        return media_object
-    return None
+# pipeline checks a record must have, even if one of its stages blew up
+PIPELINE_CHECKS = [
+    "local_paths_exist",
+    "source_available",
+    "preview_available",
+    "preview_uploaded",
+    "processing_successful",
+    "metadata_updated"
+]
+
+# the checks a record needs to count as processed
+REQUIRED_CHECKS = [
+    "processing_successful",
+    "metadata_updated"
+]
 
 def handler(event, context):
     
     # input key: /audio/full/$DOCUMENT_ID/$POLLY_GENERATED.mp3
-    
-    Records = event["Records"]
-    # assuming all objects are coming from the same bucket
-    bucket = Records[0]["s3"]["bucket"]["name"]
+    # S3 records come straight from the bucket, or wrapped in SQS messages
+    Records, message_ids, unreadable = batch.unwrap(event)
     
     # [ "bucket_name", "audio/full/$DOCUMENT_ID/$POLLY_GENERATED.mp3" ]
     object_pairs = [ 
-        [ bucket, x["s3"]["object"]["key"] ]
+        [ x["s3"]["bucket"]["name"], x["s3"]["object"]["key"] ]
         for x in Records 
     ]
     
     media_objects = [ create_media_object(pair) for pair in object_pairs]
     
-    # "/tmp/audio/full/$DOCUMENT_ID/$POLLY_GENERATED.mp3"
-    print(media_objects)
-    
-    local_paths = [ create_local_paths(media_object) for media_object in media_objects]
+    # each record goes through the full pipeline on its own, no barrier between stages:
+    # one narration can be uploading its preview while another is still being faded out
+    # "$SCOPE/preview/$POLLY_GENERATED.wav"
+    updates = pipeline.run(
+        media_objects, PIPELINE, PIPELINE_CHECKS, FADEOUT_MAX_WORKERS,
+        hooks=(pipeline.record_timing, metrics.stage_hook)
+    )
     
-    full_narrations = [ download(local_path) for local_path in local_paths ]
+    successful_ops, failed_ops = pipeline.outcomes(updates, REQUIRED_CHECKS)
     
-    # "/tmp/audio/preview/$DOCUMENT_ID/$POLLY_GENERATED.wav"
-    previews = [ fade_out(full_narration) for full_narration in full_narrations ]
+    # the files of every record are gone before the next invocation, whatever happened to it
+    for update in updates:
+        workspace.release(update["workspace_path"])
     
-    uploads = [ upload(preview) for preview in previews]
+    pipeline.report(successful_ops, failed_ops)
     
-    checks = [ check_for_failure(upload) for upload in uploads]
-    
-    updates = [ update_metadata(check) for check in checks]
-    
-    successful_ops = [is_successful_ops(update) for update in updates]
-    failed_ops = [ is_failed_ops(update) for update in updates]
-    
-    print("****************RESULTS****************")
-    
-    print(successful_ops)
-    print(failed_ops)
-    
-    return {
-        "statusCode":200,
-        "body": json.dumps({
-            "SuccessfulOps" : successful_ops,
-            "FailedOps": failed_ops
-            
-        }, default=default)
-    }
+    return batch.response(
+        event,
+        message_ids,
+        [pipeline.summarize(update, PIPELINE_CHECKS, REQUIRED_CHECKS) for update in updates],
+        unreadable
+    )
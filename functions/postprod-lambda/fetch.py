@@ -0,0 +1,126 @@
+import os
+import socket
+import threading
+import time
+import urllib3
+from concurrent.futures import ThreadPoolExecutor
+from urllib3.util import Retry, Timeout
+
+FETCH_MAX_WORKERS     = int(os.environ.get("FETCH_MAX_WORKERS", 4))
+FETCH_POOL_SIZE       = int(os.environ.get("FETCH_POOL_SIZE", 16))
+FETCH_CONNECT_TIMEOUT = float(os.environ.get("FETCH_CONNECT_TIMEOUT", 3))
+FETCH_READ_TIMEOUT    = float(os.environ.get("FETCH_READ_TIMEOUT", 10))
+FETCH_RETRIES         = int(os.environ.get("FETCH_RETRIES", 3))
+FETCH_BACKOFF         = float(os.environ.get("FETCH_BACKOFF", 0.5))
+# seconds a download may take in total, retries and the body included: the timeouts above
+# only bound each socket operation, a host trickling bytes would never hit them
+FETCH_DEADLINE        = float(os.environ.get("FETCH_DEADLINE", 30))
+FETCH_CHUNK_SIZE      = 64 * 1024
+
+class DeadlineRetry(Retry):
+    # a Retry that stops once deadline (time.monotonic()) has passed, whatever attempts are left,
+    # and never sleeps past it, Retry-After included
+
+    def __init__(self, *args, deadline=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.deadline = deadline
+
+    def new(self, **kwargs):
+        kwargs.setdefault("deadline", self.deadline)
+        return super().new(**kwargs)
+
+    def is_exhausted(self):
+        return super().is_exhausted() or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+    def sleep(self, response=None):
+        if self.deadline is None:
+            return super().sleep(response)
+        wait = self.get_retry_after(response) if response is not None and self.respect_retry_after_header else None
+        if wait is None:
+            wait = self.get_backoff_time()
+        time.sleep(max(0, min(wait, self.deadline - time.monotonic())))
+
+# each download retries with a copy of this, bound to its own deadline
+retries = DeadlineRetry(
+    total=FETCH_RETRIES,
+    backoff_factor=FETCH_BACKOFF,
+    status_forcelist=[429, 500, 502, 503, 504],
+    raise_on_status=False
+)
+
+# module level so that keep-alive connections are reused across records
+# and across warm invocations of the same container
+http = urllib3.PoolManager(
+    maxsize=FETCH_POOL_SIZE,
+    timeout=Timeout(connect=FETCH_CONNECT_TIMEOUT, read=FETCH_READ_TIMEOUT),
+    retries=retries
+)
+
+def _shutdown(response):
+    # the body is read from the socket file of the http.client response: the connection
+    # itself lets go of its socket when the host asked to close it after the response
+    fp = getattr(getattr(response, "_fp", None), "fp", None)
+    sock = getattr(getattr(fp, "raw", None), "_sock", None) or getattr(response.connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def download(url, output_path):
+    # streams the body to output_path, returns output_path or None
+    # gives up once the download took FETCH_DEADLINE seconds, a slow host can't hold the record
+    deadline = time.monotonic() + FETCH_DEADLINE
+    try:
+        response = http.request("GET", url, preload_content=False, retries=retries.new(deadline=deadline))
+    except urllib3.exceptions.HTTPError as e:
+        print(f"{url}: {e}")
+        return None
+
+    # a host trickling bytes keeps every socket read under the read timeout, and a chunk only
+    # comes back once it is full: at the deadline the connection is shut down, which fails the read
+    watchdog = threading.Timer(max(0.0, deadline - time.monotonic()), _shutdown, [response])
+    watchdog.daemon = True
+    watchdog.start()
+
+    try:
+        if response.status != 200:
+            print(f"{url}: HTTP {response.status}")
+            return None
+
+        with open(output_path, "wb") as fp:
+            for chunk in response.stream(FETCH_CHUNK_SIZE):
+                fp.write(chunk)
+
+    except (urllib3.exceptions.HTTPError, OSError) as e:
+        if time.monotonic() >= deadline:
+            print(f"{url}: gave up after {FETCH_DEADLINE}s")
+        else:
+            print(f"{url}: {e}")
+        return None
+
+    finally:
+        watchdog.cancel()
+        response.release_conn()
+
+    return output_path
+
+def etag(url):
+    # cheap HEAD request, returns the ETag of url or None if the host doesn't send one
+    try:
+        response = http.request("HEAD", url)
+    except urllib3.exceptions.HTTPError as e:
+        print(f"{url}: {e}")
+        return None
+
+    if response.status != 200:
+        return None
+    return response.headers.get("ETag")
+
+def map_all(function, items):
+    # runs function over items concurrently, results are returned in the same order
+    if not items:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(FETCH_MAX_WORKERS, len(items))) as executor:
+        return list(executor.map(function, items))
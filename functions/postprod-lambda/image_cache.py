@@ -0,0 +1,65 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+
+import transcode
+
+IMAGE_CACHE_ENABLED     = os.environ.get("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_PREFIX      = os.environ.get("IMAGE_CACHE_PREFIX", "image/cache")
+IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", 512))
+
+# bump when the conversion output changes, so stale overlays are never reused
+CACHE_VERSION = "1"
+
+# warm layer: cache key -> s3 path of the converted overlay, survives warm invocations
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+def _digest(*parts):
+    slot = f"{transcode.IMAGE_SLOT_WIDTH}x{transcode.IMAGE_SLOT_HEIGHT}"
+    sha = hashlib.sha256()
+    for part in (CACHE_VERSION, slot) + parts:
+        sha.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        sha.update(b"\n")
+    return sha.hexdigest()
+
+def key_for_url(url, etag):
+    return _digest(url, etag)
+
+def key_for_file(local_path):
+    sha = hashlib.sha256()
+    with open(local_path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return _digest(sha.hexdigest())
+
+def s3_key(cache_key):
+    return f"{IMAGE_CACHE_PREFIX}/{cache_key}.tga"
+
+def remember(cache_key, s3_path):
+    with _lock:
+        _entries[cache_key] = s3_path
+        _entries.move_to_end(cache_key)
+        while len(_entries) > IMAGE_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+def lookup(s3, bucket, cache_key):
+    # returns the s3 path of an already converted overlay, or None
+    with _lock:
+        if cache_key in _entries:
+            _entries.move_to_end(cache_key)
+            return _entries[cache_key]
+
+    key = s3_key(cache_key)
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+            print(e)
+        return None
+
+    s3_path = f"s3://{bucket}/{key}"
+    remember(cache_key, s3_path)
+    return s3_path
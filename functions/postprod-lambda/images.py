@@ -1,30 +1,93 @@
 import os
 import subprocess
 import pathlib
-import boto3
 import json
-import urllib.request
 from botocore.exceptions import ClientError
 from decimal import Decimal
 
+import batch
+import clients
+import fetch
+import image_cache
+import metrics
+import pipeline
+import transcode
+import workspace
+
 try:
     POLLY_METADATA_STORE = os.environ['POLLY_METADATA_STORE']
 except KeyError as e:
     print(f"Missing env variable: {e}")
     exit(1)
 
-s3 = boto3.client("s3")
-dynamo = boto3.resource("dynamodb")
-polly_metadata_store = dynamo.Table(POLLY_METADATA_STORE)
+# records are processed concurrently, each one running through the whole pipeline
+IMAGES_MAX_WORKERS = int(os.environ.get("IMAGES_MAX_WORKERS", 8))
+# images post-produced for each article, the full video shows all of them
+IMAGES_MAX_COUNT = int(os.environ.get("IMAGES_MAX_COUNT", 4))
+# "compact" triggers only carry what VideoLambda reads, "full" ones the whole article
+VIDEO_TRIGGER_FORMAT = os.environ.get("VIDEO_TRIGGER_FORMAT", "compact").lower()
+VIDEO_TRIGGER_VERSION = 2
+VIDEO_TRIGGER_FIELDS = [
+    "AudioPreview",
+    "PostProducedImagesS3Paths",
+    "FullNarration",
+    "FullNarrationDurationInSeconds",
+    "ImageWeights"
+]
 
-ROOT_PATH = "/tmp"
+# created on first use, see clients.py in the shared layer
+s3 = clients.lazy("s3")
+polly_metadata_store = clients.table(POLLY_METADATA_STORE)
 
 def default(obj):
     if isinstance(obj, Decimal):
         return str(obj)
+    if isinstance(obj, pipeline.MediaRecord):
+        return obj.to_dict()
     raise TypeError("Object of type '%s' is not JSON serializable" % type(obj).__name__)
 
 
+class ArticleRecord(pipeline.MediaRecord):
+    # media_object of an article: its paths, what the stages produce and the pipeline checks
+    __slots__ = (
+        "s3_full_path",
+        "s3_path",
+        "s3_bucket",
+        "s3_key",
+        "media_type",
+        "media_format",
+        "media_extension",
+        "media_polly_file",
+        "media_polly_no_extension",
+        "media_document_id",
+        "workspace_path",
+        "source_local_path",
+        "output_local_path",
+        "source_s3_path",
+        "output_s3_path",
+        "output_s3_key",
+        "article_s3_path",
+        "article_s3_key",
+        "article_local_path",
+        "video_trigger_s3_path",
+        "video_trigger_s3_key",
+        "article_body",
+        "images_urls",
+        "images",
+        "source_images_local_paths",
+        "output_images_local_paths",
+        "output_images_s3_paths",
+        "metadata",
+        "local_paths_exist",
+        "article_available",
+        "source_images_available",
+        "output_images_available",
+        "images_uploaded",
+        "processing_successful",
+        "metadata_updated",
+        "video_pipeline_triggered"
+    )
+
 def create_media_object(pair):
     bucket, input_path = pair
     
@@ -41,7 +104,7 @@ def create_media_object(pair):
     # get anything between input_format and input_polly
     input_document = "/".join(input_split[2:-1]) 
     
-    return {
+    return ArticleRecord(**{
         "s3_full_path": f"s3://{bucket}/{input_path}",
         "s3_path":f"{bucket}/{input_path}",
         "s3_bucket": bucket,
@@ -52,22 +115,25 @@ def create_media_object(pair):
         "media_polly_file": input_polly,
         "media_polly_no_extension": input_polly_no_ext,
         "media_document_id": input_document,
-        "source_local_path": f"{ROOT_PATH}/source/{input_document}",
-        "output_local_path": f"{ROOT_PATH}/output/{input_document}",
         "source_s3_path": f"s3://{bucket}/image/source/{input_document}",
         "output_s3_path": f"s3://{bucket}/image/output/{input_document}",
         "output_s3_key":  f"image/output/{input_document}",
         "article_s3_path": f"s3://{bucket}/text/{input_document}",
         "article_s3_key": f"text/{input_document}",
-        "article_local_path": f"{ROOT_PATH}/source/{input_document}/{input_document}", # by design is /tmp/source/article.json/article/json
-        "video_trigger_local_path": f"{ROOT_PATH}/output/{input_document}/{input_document}",
         "video_trigger_s3_path": f"s3://{bucket}/video-trigger/{input_document}",
         "video_trigger_s3_key": f"video-trigger/{input_document}"
-    }
+    })
 
 # pipeline_check : media_object["local_paths_exist"]
 def create_local_paths(media_object):
     try:
+        # a scope of the workspace per record, released by the handler once the record is done
+        scope = workspace.open_scope(media_object["media_document_id"])
+        media_object["workspace_path"] = scope
+        media_object["source_local_path"] = f"{scope}/source"
+        media_object["output_local_path"] = f"{scope}/output"
+        # by design is $SCOPE/source/article.json
+        media_object["article_local_path"] = f"{scope}/source/{media_object['media_document_id']}"
         pathlib.Path(media_object["source_local_path"]).mkdir(parents=True, exist_ok=True)
         pathlib.Path(media_object["output_local_path"]).mkdir(parents=True, exist_ok=True)
         media_object["local_paths_exist"] = True
@@ -89,9 +155,60 @@ def download_article_object(media_object):
         with open(filename, "wb") as fp:
             s3.download_fileobj(bucket, key, fp)
             media_object["article_available"] = True
+        
+        workspace.charge(media_object["workspace_path"], filename)
 
     return media_object
 
+def download_image(media_object, index, url):
+    
+    bucket = media_object["s3_bucket"]
+    image = {
+        "index": index,
+        "url": url,
+        "cache_key": None,
+        "source_local_path": None,
+        "output_local_path": None,
+        "output_s3_path": None
+    }
+    
+    # an overlay converted for another article can be reused without downloading
+    if image_cache.IMAGE_CACHE_ENABLED:
+        etag = fetch.etag(url)
+        if etag:
+            image["cache_key"] = image_cache.key_for_url(url, etag)
+            image["output_s3_path"] = image_cache.lookup(s3, bucket, image["cache_key"])
+            if image["output_s3_path"]:
+                return image
+            # converted by an earlier record of this container, but not uploaded to the cache
+            image["output_local_path"] = workspace.cache_get(
+                f"{image['cache_key']}.tga",
+                f"{media_object['output_local_path']}/{image['cache_key']}.tga"
+            )
+            if image["output_local_path"]:
+                return image
+    
+    # images are downloaded concurrently and two urls can share a basename:
+    # the position in the article keeps every local file distinct
+    image["source_local_path"] = fetch.download(
+        url,
+        f"{media_object['source_local_path']}/{index}-{url.split('/')[-1]}"
+    )
+    if image["source_local_path"]:
+        workspace.charge(media_object["workspace_path"], image["source_local_path"])
+    
+    # no ETag from the host: fall back to the hash of the content
+    if image_cache.IMAGE_CACHE_ENABLED and image["source_local_path"] and not image["cache_key"]:
+        image["cache_key"] = image_cache.key_for_file(image["source_local_path"])
+        image["output_s3_path"] = image_cache.lookup(s3, bucket, image["cache_key"])
+        if not image["output_s3_path"]:
+            image["output_local_path"] = workspace.cache_get(
+                f"{image['cache_key']}.tga",
+                f"{media_object['output_local_path']}/{image['cache_key']}.tga"
+            )
+
+    return image
+
 # pipeline_check : media_object["source_images_available"]
 def download_images(media_object):
     
@@ -99,59 +216,99 @@ def download_images(media_object):
     
     if media_object["article_available"]:
         
-        media_object["source_images_local_paths"] = []
-        
         with open(media_object["article_local_path"]) as fp:
             json_object = json.load(fp)
             media_object["article_body"] = json_object
             media_object["images_urls"] = json_object["ImagesURLs"]
     
-        # downloading only the first 4 images
-        for url in media_object["images_urls"][:4]:
-            source_filename = url.split("/")[-1]
-            output_filename = f"{media_object['source_local_path']}/{source_filename}"
-            
-            http_response = urllib.request.urlopen(url)
-            with open(output_filename, "wb") as fp:
-                fp.write(http_response.read())
-            media_object["source_images_local_paths"].append(output_filename)
+        # downloading only the first IMAGES_MAX_COUNT images, in parallel
+        media_object["images"] = fetch.map_all(
+            lambda item: download_image(media_object, *item),
+            list(enumerate(media_object["images_urls"][:IMAGES_MAX_COUNT]))
+        )
+        
+        media_object["source_images_local_paths"] = [
+            image["source_local_path"] for image in media_object["images"]
+            if image["source_local_path"]
+        ]
         
-        media_object["source_images_available"] = True
+        metrics.count("Images", len(media_object["images"]), stage="download_images")
+        metrics.count("CacheHits", sum(1 for image in media_object["images"] if image["output_s3_path"]), stage="download_images")
+        metrics.size("Bytes", sum(os.path.getsize(path) for path in media_object["source_images_local_paths"]), stage="download_images")
+        
+        if any(image["source_local_path"] or image["output_local_path"] or image["output_s3_path"] for image in media_object["images"]):
+            media_object["source_images_available"] = True
     
     return media_object
             
-def convert_image(input_path, output_path):
+def convert_image_ffmpeg(input_path, output_path):
+    width  = transcode.IMAGE_SLOT_WIDTH
+    height = transcode.IMAGE_SLOT_HEIGHT
+    
     FFMPEG_COMMAND = [
         "./bin/ffmpeg",
+        "-y",
         "-i",
         input_path,
+        # fit to the slot keeping the aspect ratio, letterbox on transparent padding
+        "-vf",
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:color=black@0",
+        "-pix_fmt",
+        "bgra",
+        "-rle",
+        "1",
         output_path
     ]
     
-    print(" ".join(FFMPEG_COMMAND))
-        
+    metrics.log("ffmpeg", " ".join(FFMPEG_COMMAND))
+    
     p = subprocess.Popen(FFMPEG_COMMAND, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     
     out, err = p.communicate()
-    # because ffmpeg outputs on error stream by default
-    print(err)
-        
-    if os.path.isfile(output_path):
+    
+    if p.returncode == 0 and os.path.isfile(output_path):
         return output_path
+    
+    # because ffmpeg outputs on error stream by default, only the tail is relevant
+    err = err.decode("utf-8", errors="replace")
+    metrics.log("ffmpeg", err[-metrics.LOG_MAX_CHARS:], always=True)
     return None
 
+def convert_image(input_path, output_path):
+    # in-process first, ffmpeg for anything the engine can't decode
+    converted = transcode.convert(input_path, output_path)
+    if converted is not None:
+        return converted
+    return convert_image_ffmpeg(input_path, output_path)
+
 # pipeline_check : media_object["output_images_available"]
 def convert_images(media_object):
     
     media_object["output_images_available"] = False
     
     if media_object["source_images_available"]:
+        
+        # cached overlays are already converted, and maybe uploaded
+        for image in media_object["images"]:
+            if image["source_local_path"] and not image["output_s3_path"] and not image["output_local_path"]:
+                image["output_local_path"] = convert_image(
+                    image["source_local_path"],
+                    f"{image['source_local_path']}.tga"
+                )
+                if image["output_local_path"]:
+                    workspace.charge(media_object["workspace_path"], image["output_local_path"])
+                    # later records in this container can skip the download and the conversion
+                    if image["cache_key"]:
+                        workspace.cache_put(f"{image['cache_key']}.tga", image["output_local_path"])
+        
         media_object["output_images_local_paths"] = [
-            convert_image(image_filename, f"{image_filename}.tga")
-            for image_filename in media_object["source_images_local_paths"]
+            image["output_local_path"] for image in media_object["images"]
+            if image["output_local_path"]
         ]
         
-        if any(media_object["output_images_local_paths"]):
+        metrics.count("Images", len(media_object["output_images_local_paths"]), stage="convert_images")
+        
+        if any(image["output_local_path"] or image["output_s3_path"] for image in media_object["images"]):
             media_object["output_images_available"] = True
     
     return media_object
@@ -168,6 +325,7 @@ def upload_image(local_path, bucket, key):
         print(e)
         return None
     
+    metrics.size("Bytes", os.path.getsize(local_path), stage="upload")
     return f"s3://{bucket}/{key}"
 
 # pipeline_check : media_object["images_uploaded"]
@@ -181,13 +339,29 @@ def upload(media_object):
         output_key = media_object["output_s3_key"]
         get_filename = lambda x : x.split("/")[-1]
         
+        for image in media_object["images"]:
+            if not image["output_local_path"] or image["output_s3_path"]:
+                continue
+            
+            # overlays with a cache key go to the shared cache prefix, so other articles can reuse them
+            if image["cache_key"]:
+                image["output_s3_path"] = upload_image(
+                    image["output_local_path"],
+                    bucket,
+                    image_cache.s3_key(image["cache_key"])
+                )
+                if image["output_s3_path"]:
+                    image_cache.remember(image["cache_key"], image["output_s3_path"])
+            else:
+                image["output_s3_path"] = upload_image(
+                    image["output_local_path"],
+                    bucket,
+                    f"{output_key}/{get_filename(image['output_local_path'])}"
+                )
+        
         media_object["output_images_s3_paths"] = [
-            upload_image(
-                output_image_local_path,
-                bucket, 
-                f"{output_key}/{get_filename(output_image_local_path)}"
-            )
-            for output_image_local_path in media_object["output_images_local_paths"]
+            image["output_s3_path"] for image in media_object["images"]
+            if image["output_s3_path"]
         ]
         
         if any(media_object["output_images_s3_paths"]):
@@ -240,99 +414,148 @@ def update_metadata(media_object):
     
     return media_object
 
+def image_positions(media_object):
+    # ImagePositions has one offset per url of ImagesURLs, but images that failed to download
+    # or convert are missing from the S3 paths: keep the offsets of the images that made it,
+    # in the order of their paths, so each weight stays with its image
+    positions = (media_object["article_body"] or {}).get("ImagePositions")
+    if not positions or len(positions) != len(media_object["images_urls"] or []):
+        return None
+    return [
+        positions[image["index"]] for image in media_object["images"] or []
+        if image["output_s3_path"]
+    ]
+
+def compact_trigger(media_object):
+    # only what VideoLambda reads: job inputs from the metadata and the image weighting
+    metadata = media_object['metadata']['Attributes']
+    article_body = media_object.get('article_body') or {}
+    
+    trigger = {
+        "Version": VIDEO_TRIGGER_VERSION,
+        "Bucket": media_object['s3_bucket'],
+        "Key": media_object['video_trigger_s3_key'],
+        "AssetId": media_object['media_document_id'],
+        "Metadata": {
+            field: metadata[field] for field in VIDEO_TRIGGER_FIELDS if field in metadata
+        }
+    }
+    
+    # the article text is only needed for its length, ImagePositions are written by the scrape step
+    positions = image_positions(media_object)
+    if positions and article_body.get("Text"):
+        trigger["ArticleBody"] = {
+            "ImagePositions": positions,
+            "TextLength": len(article_body["Text"])
+        }
+    
+    return trigger
+
+def full_trigger(media_object):
+    article_body = dict(media_object['article_body'] or {})
+    if "ImagePositions" in article_body:
+        article_body["ImagePositions"] = image_positions(media_object)
+    
+    return {
+        "Bucket": media_object['s3_bucket'],
+        "Key": media_object['video_trigger_s3_key'],
+        "AssetId": media_object['media_document_id'],
+        "ArticleBody": article_body,
+        "Metadata": media_object['metadata']['Attributes']
+    }
+
 def trigger_video_pipeline(media_object):
     
     media_object['video_pipeline_triggered'] = False
     
     if media_object["metadata_updated"]:
     
-        output_file = {
-            "Bucket": media_object['s3_bucket'],
-            "Key": media_object['video_trigger_s3_key'],
-            "AssetId": media_object['media_document_id'],
-            "ArticleBody": media_object['article_body'],
-            "Metadata": media_object['metadata']['Attributes']
-        }
+        if VIDEO_TRIGGER_FORMAT == "compact":
+            output_file = compact_trigger(media_object)
+        else:
+            output_file = full_trigger(media_object)
         
-        with open(media_object["video_trigger_local_path"], "w") as fp:
-            json.dump(output_file, fp, default=default)
+        # serialized in memory and put directly, no round trip through /tmp
+        body = json.dumps(output_file, default=default, separators=(",", ":")).encode("utf-8")
         
         try:
-            s3.upload_file(
-                media_object['video_trigger_local_path'],
-                media_object['s3_bucket'],
-                media_object['video_trigger_s3_key']
+            s3.put_object(
+                Bucket=media_object['s3_bucket'],
+                Key=media_object['video_trigger_s3_key'],
+                Body=body,
+                ContentType="application/json"
             )
             
             media_object['video_pipeline_triggered'] = True
             
         except ClientError as e:
             print(e)
-            return None
         
     return media_object
 
-def is_successful_ops(media_object):
-    if media_object["processing_successful"] and media_object["metadata_updated"] and media_object["video_pipeline_triggered"]:
-        return media_object
-    return None
+# every stage of the pipeline, in order
+PIPELINE = [
+    create_local_paths,
+    download_article_object,
+    download_images,
+    convert_images,
+    upload,
+    check_for_failure,
+    update_metadata,
+    trigger_video_pipeline
+]
 
-def is_failed_ops(media_object):
-    if not media_object["processing_successful"] or not media_object["metadata_updated"] or not media_object["video_pipeline_triggered"]:
-        return media_object
-    return None
+# pipeline checks a record must have, even if one of its stages blew up
+PIPELINE_CHECKS = [
+    "local_paths_exist",
+    "article_available",
+    "source_images_available",
+    "output_images_available",
+    "images_uploaded",
+    "processing_successful",
+    "metadata_updated",
+    "video_pipeline_triggered"
+]
 
-    
-    
+# the checks a record needs to count as processed
+REQUIRED_CHECKS = [
+    "processing_successful",
+    "metadata_updated",
+    "video_pipeline_triggered"
+]
 
 def handler(event, context):
     
     # input key: /audio/preview/$DOCUMENT_ID/$POLLY_GENERATED.wav
-    
-    Records = event["Records"]
-    # assuming all objects are coming from the same bucket
-    bucket = Records[0]["s3"]["bucket"]["name"]
+    # S3 records come straight from the bucket, or wrapped in SQS messages
+    Records, message_ids, unreadable = batch.unwrap(event)
     
     # [ "bucket_name", "audio/preview/$DOCUMENT_ID/$POLLY_GENERATED.wav" ]
     object_pairs = [ 
-        [ bucket, x["s3"]["object"]["key"] ]
+        [ x["s3"]["bucket"]["name"], x["s3"]["object"]["key"] ]
         for x in Records 
     ]
     
     media_objects = [ create_media_object(pair) for pair in object_pairs]
     
-    local_paths = [ create_local_paths(media_object) for media_object in media_objects]
-    
-    articles = [download_article_object(local_path) for local_path in local_paths]
-    
-    images = [download_images(article) for article in articles]
-    
-    targas = [convert_images(image) for image in images]
-    
-    uploads = [ upload(targa) for targa in targas]
+    # each record goes through the full pipeline on its own, so a slow download
+    # for one article does not hold back the others
+    updates = pipeline.run(
+        media_objects, PIPELINE, PIPELINE_CHECKS, IMAGES_MAX_WORKERS,
+        hooks=(pipeline.record_timing, metrics.stage_hook)
+    )
     
-    checks = [ check_for_failure(upload) for upload in uploads]
+    successful_ops, failed_ops = pipeline.outcomes(updates, REQUIRED_CHECKS)
     
-    updates = [ update_metadata(check) for check in checks]
+    # the files of every record are gone before the next invocation, whatever happened to it
+    for update in updates:
+        workspace.release(update["workspace_path"])
     
-    trigger_videos = [trigger_video_pipeline(update) for update in updates]
+    pipeline.report(successful_ops, failed_ops)
     
-    print(trigger_videos)
-    
-    successful_ops = [is_successful_ops(update) for update in updates]
-    failed_ops = [ is_failed_ops(update) for update in updates]
-    
-    print("****************RESULTS****************")
-    
-    print(successful_ops)
-    print(failed_ops)
-    
-    return {
-        "statusCode":200,
-        "body": json.dumps({
-            "SuccessfulOps" : successful_ops,
-            "FailedOps": failed_ops
-        }, default=default)
-    }
-
-    
\ No newline at end of file
+    return batch.response(
+        event,
+        message_ids,
+        [pipeline.summarize(update, PIPELINE_CHECKS, REQUIRED_CHECKS) for update in updates],
+        unreadable
+    )
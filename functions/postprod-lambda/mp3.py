@@ -0,0 +1,153 @@
+import mmap
+from collections import namedtuple
+
+# kbps, indexed by [version is MPEG-1][bitrate index], layer III only
+BITRATES = {
+    True:  [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0],
+    False: [0,  8, 16, 24, 32, 40, 48, 56,  64,  80,  96, 112, 128, 144, 160, 0]
+}
+
+# Hz, indexed by [version bits][sample rate index]
+SAMPLE_RATES = {
+    0b11: [44100, 48000, 32000],   # MPEG-1
+    0b10: [22050, 24000, 16000],   # MPEG-2
+    0b00: [11025, 12000,  8000]    # MPEG-2.5
+}
+
+FrameHeader = namedtuple("FrameHeader", [
+    "offset",
+    "mpeg1",
+    "bitrate",
+    "sample_rate",
+    "channels",
+    "samples",
+    "length"
+])
+
+def id3v2_size(data):
+    # size of the ID3v2 tag at the start of data, 0 if there's none
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+def parse_frame_header(data, offset=0):
+    # returns a FrameHeader for the layer III frame starting at data[offset], or None
+    if offset + 4 > len(data):
+        return None
+
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+
+    version = (b1 >> 3) & 0b11
+    layer = (b1 >> 1) & 0b11
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_rate_index = (b2 >> 2) & 0b11
+
+    # layer III only, no reserved version / free format / bad values
+    if version == 0b01 or layer != 0b01 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 0b11
+    bitrate = BITRATES[mpeg1][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 1
+    channels = 1 if (b3 >> 6) == 0b11 else 2
+    samples = 1152 if mpeg1 else 576
+
+    length = (samples // 8) * bitrate // sample_rate + padding
+
+    return FrameHeader(offset, mpeg1, bitrate, sample_rate, channels, samples, length)
+
+def find_first_frame(data):
+    # first frame header after the ID3v2 tag, confirmed by the header of the frame that follows it
+    offset = id3v2_size(data)
+    while offset + 4 <= len(data):
+        header = parse_frame_header(data, offset)
+        if header is not None:
+            following = offset + header.length
+            if following + 4 > len(data) or parse_frame_header(data, following) is not None:
+                return header
+        offset += 1
+    return None
+
+def xing_frames(data, header):
+    # frame count from a Xing/Info header in the first frame, or None
+    if header.mpeg1:
+        offset = 36 if header.channels == 2 else 21
+    else:
+        offset = 21 if header.channels == 2 else 13
+    
+    start = header.offset + offset
+    if data[start:start + 4] not in (b"Xing", b"Info"):
+        return None
+    
+    flags = int.from_bytes(data[start + 4:start + 8], "big")
+    if not flags & 0x1:
+        return None
+    return int.from_bytes(data[start + 8:start + 12], "big")
+
+def vbri_frames(data, header):
+    # frame count from a VBRI header, always 32 bytes after the frame header, or None
+    start = header.offset + 36
+    if data[start:start + 4] != b"VBRI":
+        return None
+    return int.from_bytes(data[start + 14:start + 18], "big")
+
+def scan_frames(data, first_frame):
+    # walks every frame header from the first one, returns the total number of samples
+    samples = 0
+    offset = first_frame.offset
+    while True:
+        header = parse_frame_header(data, offset)
+        if header is None or header.length <= 0:
+            break
+        samples += header.samples
+        offset += header.length
+    return samples
+
+def duration(data, total_size=None):
+    # duration in seconds of the mp3 in data (bytes, bytearray or mmap), or None
+    #   Xing/Info and VBRI headers give the exact frame count of VBR files,
+    #   a complete buffer is otherwise scanned frame by frame,
+    #   a leading slice of a larger object (total_size) is estimated as CBR
+    first_frame = find_first_frame(data)
+    if first_frame is None:
+        return None
+    
+    frames = xing_frames(data, first_frame) or vbri_frames(data, first_frame)
+    if frames:
+        return frames * first_frame.samples / first_frame.sample_rate
+    
+    if total_size is None or total_size <= len(data):
+        return scan_frames(data, first_frame) / first_frame.sample_rate
+    
+    return estimate_duration(first_frame, total_size)
+
+def duration_from_file(path):
+    # memory maps the file, so only the pages actually walked are read
+    with open(path, "rb") as fp:
+        try:
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return None
+        with data:
+            return duration(data)
+
+def duration_from_range(read_range, total_size, probe_bytes=64 * 1024):
+    # read_range(start, end) returns the bytes of an inclusive range of the object,
+    # e.g. an S3 range GET: only the leading probe_bytes are ever fetched
+    data = read_range(0, min(probe_bytes, total_size) - 1)
+    return duration(data, total_size=total_size)
+
+def estimate_duration(first_frame, total_size):
+    # constant bitrate estimate from the size of the audio payload, in seconds
+    audio_bytes = total_size - first_frame.offset
+    return audio_bytes * 8 / first_frame.bitrate
+
+def bytes_for_duration(first_frame, seconds):
+    # how many leading bytes of the object cover the first `seconds` of audio
+    return first_frame.offset + int(seconds * first_frame.bitrate / 8)
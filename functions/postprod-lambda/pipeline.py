@@ -0,0 +1,119 @@
+import time
+
+import batch
+import metrics
+from concurrent.futures import ThreadPoolExecutor
+
+class MediaRecord:
+    # a media_object with a fixed set of fields: no per-record __dict__, and a typo in a stage
+    # fails loudly instead of silently adding a key. Subclasses list their fields in __slots__.
+    # Fields are still read and written like dict keys, so stages work on either.
+    __slots__ = ("timings",)
+
+    def __init__(self, **fields):
+        for name in self.fields():
+            setattr(self, name, None)
+        self.timings = {}
+        for name, value in fields.items():
+            self[name] = value
+
+    @classmethod
+    def fields(cls):
+        return [name for klass in reversed(cls.__mro__) for name in getattr(klass, "__slots__", ())]
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        try:
+            setattr(self, name, value)
+        except AttributeError:
+            raise KeyError(f"{type(self).__name__} has no field {name}")
+
+    def __contains__(self, name):
+        return name in self.fields()
+
+    def get(self, name, default=None):
+        # fields that were never set are None
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.fields()}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()})"
+
+def record_timing(stage_name, record, seconds):
+    # default hook: keeps how long each stage took on the record itself
+    record.timings[stage_name] = seconds
+
+def process(record, stages, checks, hooks=(record_timing,)):
+    # runs a record through every stage, in order
+    #   checks are reset first, so a record has all of them even if a stage blows up
+    #   every hook is called as hook(stage_name, record, seconds) after each stage
+    for check in checks:
+        record[check] = False
+
+    stage_name = None
+    try:
+        for stage in stages:
+            stage_name = stage.__name__
+            started = time.perf_counter()
+            record = stage(record)
+            elapsed = time.perf_counter() - started
+            for hook in hooks:
+                hook(stage_name, record, elapsed)
+    except Exception as e:
+        # a failing record must not take down the rest of the batch
+        print(f"{stage_name}: {e}")
+
+    return record
+
+def is_successful(record, required):
+    # a record succeeded when every one of the required checks passed
+    return all(record[check] for check in required)
+
+def outcomes(records, required):
+    # (successful_ops, failed_ops) as report takes them: each record is in one list and None in the other
+    successful = [is_successful(record, required) for record in records]
+    return (
+        [record if ok else None for record, ok in zip(records, successful)],
+        [None if ok else record for record, ok in zip(records, successful)]
+    )
+
+def summarize(record, checks, required):
+    # what the handler reports for a record, the failed checks tell which stage it stopped at
+    successful = is_successful(record, required)
+    return batch.summary(
+        record["s3_key"],
+        successful,
+        AssetId=record["media_document_id"],
+        FailedChecks=[] if successful else [check for check in checks if not record[check]]
+    )
+
+def report(successful_ops, failed_ops):
+    # record counts and a sample of the results, every failure is logged (bounded) and metrics flushed
+    failures = [op for op in failed_ops if op is not None]
+
+    metrics.count("Records", len(successful_ops))
+    metrics.count("Failed", len(failures))
+
+    for failure in failures:
+        metrics.log("failed", failure, always=True)
+    metrics.log("succeeded", [op for op in successful_ops if op is not None])
+
+    metrics.flush()
+
+def run(records, stages, checks, max_workers, hooks=(record_timing,)):
+    # every record goes through the whole pipeline on its own worker, so it moves on to its
+    # next stage as soon as its current one finishes, without waiting on the rest of the batch
+    # results are returned in the same order as records
+    if not records:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(records)))) as executor:
+        return list(executor.map(lambda record: process(record, stages, checks, hooks), records))
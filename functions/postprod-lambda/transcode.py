@@ -0,0 +1,43 @@
+import os
+
+# Pillow is optional: when it's not bundled with the function
+# every conversion falls back to ffmpeg
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:
+    Image = None
+
+# "pillow" converts in-process and falls back to ffmpeg, "ffmpeg" always spawns ffmpeg
+TRANSCODE_ENGINE = os.environ.get("TRANSCODE_ENGINE", "pillow")
+
+# geometry of the InsertableImages slots used by the video pipeline
+IMAGE_SLOT_WIDTH  = int(os.environ.get("IMAGE_SLOT_WIDTH", 1100))
+IMAGE_SLOT_HEIGHT = int(os.environ.get("IMAGE_SLOT_HEIGHT", 800))
+
+def is_available():
+    return Image is not None and TRANSCODE_ENGINE == "pillow"
+
+def fit_to_slot(image, width=IMAGE_SLOT_WIDTH, height=IMAGE_SLOT_HEIGHT):
+    # scales the image to fit the slot keeping its aspect ratio,
+    # then letterboxes it on a transparent canvas of exactly width x height
+    image = ImageOps.contain(image.convert("RGBA"), (width, height), Image.LANCZOS)
+    
+    canvas = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    canvas.paste(image, ((width - image.width) // 2, (height - image.height) // 2))
+    return canvas
+
+def convert(input_path, output_path):
+    # returns output_path, or None if the engine can't handle the input
+    if not is_available():
+        return None
+
+    try:
+        with Image.open(input_path) as image:
+            image = fit_to_slot(ImageOps.exif_transpose(image))
+            image.save(output_path, format="TGA", compression="tga_rle")
+
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        print(f"{input_path}: {e}")
+        return None
+
+    return output_path
@@ -0,0 +1,152 @@
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+import metrics
+
+# everything the post-production functions write goes under WORKSPACE_ROOT, which lives in
+# the ephemeral storage of the container and survives warm invocations
+WORKSPACE_ROOT   = os.environ.get("WORKSPACE_ROOT", "/tmp/workspace")
+# bytes the workspace may use, record scopes and cached artifacts together
+# /tmp is 512 MB unless the function asks for more ephemeral storage
+WORKSPACE_BUDGET = int(os.environ.get("WORKSPACE_BUDGET_MB", 384)) * 1024 * 1024
+# keep converted artifacts across records until the budget needs the space
+WORKSPACE_CACHE_ENABLED = os.environ.get("WORKSPACE_CACHE_ENABLED", "true").lower() == "true"
+
+SCOPES_PATH = os.path.join(WORKSPACE_ROOT, "scopes")
+CACHE_PATH  = os.path.join(WORKSPACE_ROOT, "cache")
+
+# scope path -> bytes written in it, a scope is released when its record is done
+_scopes = {}
+# cache key -> (path, bytes), least recently used first
+_cache = OrderedDict()
+_lock = threading.Lock()
+_swept = False
+
+def _sweep():
+    # a previous runtime of this container may have been killed mid-record (timeout, OOM)
+    # and left its files behind: nothing under the workspace is known to this one yet
+    global _swept
+    if not _swept:
+        shutil.rmtree(WORKSPACE_ROOT, ignore_errors=True)
+        os.makedirs(SCOPES_PATH, exist_ok=True)
+        os.makedirs(CACHE_PATH, exist_ok=True)
+        _swept = True
+
+def used():
+    with _lock:
+        return sum(_scopes.values()) + sum(size for _, size in _cache.values())
+
+def _evict_locked(needed=0):
+    # drops cached artifacts, least recently used first, until needed more bytes fit the budget
+    # scopes in use are never evicted, the budget can be exceeded by live records alone
+    total = sum(_scopes.values()) + sum(size for _, size in _cache.values())
+    evicted = 0
+    while _cache and total + needed > WORKSPACE_BUDGET:
+        _, (path, size) = _cache.popitem(last=False)
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(e)
+        total -= size
+        evicted += 1
+    return total, evicted
+
+def _evict(needed=0):
+    with _lock:
+        total, evicted = _evict_locked(needed)
+
+    if evicted:
+        metrics.count("Evictions", evicted, stage="workspace")
+    if total + needed > WORKSPACE_BUDGET:
+        print(f"workspace over budget: {total + needed} of {WORKSPACE_BUDGET} bytes in use by live records")
+
+def open_scope(name):
+    # a directory of its own for one record, unique even if the same document is
+    # processed twice in a batch
+    safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)[:64]
+    path = os.path.join(SCOPES_PATH, f"{safe_name}-{uuid.uuid4().hex[:8]}")
+    with _lock:
+        _sweep()
+        os.makedirs(path)
+        _scopes[path] = 0
+    return path
+
+def charge(scope, path):
+    # accounts for a file written in scope, evicting cached artifacts if it doesn't fit
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    with _lock:
+        if scope not in _scopes:
+            return
+        _scopes[scope] += size
+    _evict()
+
+def release(scope):
+    # deletes the scope and everything in it, safe to call more than once
+    if not scope:
+        return
+    with _lock:
+        size = _scopes.pop(scope, None)
+    if size is None:
+        return
+    shutil.rmtree(scope, ignore_errors=True)
+    metrics.size("Bytes", size, stage="workspace")
+
+def _link(source, destination):
+    # a hard link shares the blocks, so the copy costs no space and outlives the source
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def cache_get(key, path):
+    # links the cached artifact to path, in the record's scope, so evicting it later
+    # can't pull it from under the record; returns path, or None on a miss
+    if not WORKSPACE_CACHE_ENABLED:
+        return None
+    with _lock:
+        if key not in _cache:
+            return None
+        _cache.move_to_end(key)
+        cached_path, _ = _cache[key]
+        try:
+            # the same artifact asked for twice in a record is already linked at path
+            if os.path.exists(path) and os.path.samefile(cached_path, path):
+                return path
+            _link(cached_path, path)
+        except OSError as e:
+            print(e)
+            return None
+    return path
+
+def cache_put(key, path):
+    # keeps a copy of the file at path for later records, evicting others to make room
+    if not WORKSPACE_CACHE_ENABLED:
+        return
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    if size > WORKSPACE_BUDGET:
+        return
+
+    with _lock:
+        _sweep()
+        if key in _cache:
+            _cache.move_to_end(key)
+            return
+        _, evicted = _evict_locked(size)
+        cached_path = os.path.join(CACHE_PATH, key)
+        try:
+            _link(path, cached_path)
+            _cache[key] = (cached_path, size)
+        except OSError as e:
+            print(e)
+
+    if evicted:
+        metrics.count("Evictions", evicted, stage="workspace")
@@ -80,6 +80,24 @@ exports.handler = async event => {
         }
     }
     
+    /* Image positions - character offset in Text where each image appears, 
+       VideoLambda keeps each image on screen for the text that follows it */
+    const paragraphsLengths = paragraphs.map(
+        ({innerHTML}) => cheerio.load(` ${innerHTML}`).text().length
+    );
+    
+    const imagePositions = images.map( image => Math.min(
+        paragraphs.reduce(
+            (position, paragraph, index) =>
+                paragraph.compareDocumentPosition(image) & dom.window.Node.DOCUMENT_POSITION_FOLLOWING ?
+                    position + paragraphsLengths[index]
+                    :
+                    position,
+            0
+        ),
+        paragraphsText.length
+    ));
+    
     /* Comprehend - Language and Entities  */
     const ComprehendText = 
         paragraphsText?.length > 4096 ? 
@@ -201,6 +219,7 @@ exports.handler = async event => {
         Engine: Neural ? "neural" : "standard",
         Url: url,
         ImagesURLs: imagesURLs,
+        ImagePositions: imagePositions,
         TitlesText: titlesText,
         Entities: EntitiesJob.Entities,
         SRTFile,
@@ -0,0 +1,62 @@
+import json
+
+# S3 notifications reach the functions either straight from the bucket, or through an SQS
+# queue whose messages carry the same notification as their body. With a queue, the function
+# reports which messages failed (ReportBatchItemFailures) and only those are delivered again.
+
+def is_sqs(event):
+    return any(record.get("eventSource") == "aws:sqs" for record in event.get("Records", []))
+
+def unwrap(event):
+    # (s3 records, message id of each of them, ids of messages that couldn't be read)
+    # message ids are None when the bucket invoked the function directly
+    s3_records = []
+    message_ids = []
+    unreadable = []
+
+    for record in event.get("Records", []):
+        if record.get("eventSource") != "aws:sqs":
+            s3_records.append(record)
+            message_ids.append(None)
+            continue
+
+        try:
+            notification = json.loads(record["body"])
+        except (KeyError, TypeError, ValueError):
+            unreadable.append(record["messageId"])
+            continue
+
+        # s3:TestEvent messages, sent when the notification is configured, have no records
+        for s3_record in notification.get("Records", []):
+            s3_records.append(s3_record)
+            message_ids.append(record["messageId"])
+
+    return s3_records, message_ids, unreadable
+
+def summary(key, successful, **details):
+    # what a function reports for a record instead of the whole record
+    result = {"Key": key, "Successful": bool(successful)}
+    result.update({name: value for name, value in details.items() if value})
+    return result
+
+def response(event, message_ids, summaries, unreadable=()):
+    # the handler response: a compact summary of every record, and for SQS the messages
+    # to deliver again, a message fails as soon as one of its records did
+    failed_ids = list(unreadable)
+    for message_id, result in zip(message_ids, summaries):
+        if message_id is not None and not result["Successful"] and message_id not in failed_ids:
+            failed_ids.append(message_id)
+
+    body = {
+        "Records": len(summaries),
+        "Failed": sum(1 for result in summaries if not result["Successful"]),
+        "Results": summaries
+    }
+    result = {
+        "statusCode": 200,
+        "body": json.dumps(body, default=str)
+    }
+
+    if is_sqs(event):
+        result["batchItemFailures"] = [{"itemIdentifier": message_id} for message_id in failed_ids]
+    return result
@@ -0,0 +1,80 @@
+import threading
+
+# one session per container: its loaders and the service models they parse are shared
+# by every client, so only the first client of a service pays for loading its model
+_session = None
+_clients = {}
+_lock = threading.RLock()
+
+def session():
+    # boto3 itself is only imported here, so importing a handler stays cheap
+    global _session
+    with _lock:
+        if _session is None:
+            import boto3
+            _session = boto3.session.Session()
+        return _session
+
+def create(service_name, **kwargs):
+    # a new client from the shared session, session client creation isn't thread safe
+    with _lock:
+        return session().client(service_name, **kwargs)
+
+def client(service_name, **kwargs):
+    # created on first use and reused, one per service and arguments
+    key = (service_name, tuple(sorted(kwargs.items())))
+    with _lock:
+        if key not in _clients:
+            _clients[key] = create(service_name, **kwargs)
+        return _clients[key]
+
+class LazyClient:
+    # stands in for a module level client, nothing is created until the first call
+    def __init__(self, service_name, **kwargs):
+        self.service_name = service_name
+        self.kwargs = kwargs
+
+    def __getattr__(self, name):
+        return getattr(client(self.service_name, **self.kwargs), name)
+
+def lazy(service_name, **kwargs):
+    return LazyClient(service_name, **kwargs)
+
+def serialize_value(value):
+    from boto3.dynamodb.types import TypeSerializer
+    return TypeSerializer().serialize(value)
+
+def serialize(item):
+    return {key: serialize_value(value) for key, value in item.items()}
+
+def deserialize(item):
+    from boto3.dynamodb.types import TypeDeserializer
+    deserializer = TypeDeserializer()
+    return {key: deserializer.deserialize(value) for key, value in item.items()}
+
+class Table:
+    # the subset of the DynamoDB Table resource the functions use, on top of the lighter client:
+    # plain python values in, plain python values out
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.dynamodb = lazy("dynamodb")
+
+    def update_item(self, Key, AttributeUpdates, **kwargs):
+        attribute_updates = {}
+        for name, update in AttributeUpdates.items():
+            attribute_updates[name] = dict(update)
+            if "Value" in update:
+                attribute_updates[name]["Value"] = serialize_value(update["Value"])
+
+        response = self.dynamodb.update_item(
+            TableName=self.table_name,
+            Key=serialize(Key),
+            AttributeUpdates=attribute_updates,
+            **kwargs
+        )
+        if "Attributes" in response:
+            response["Attributes"] = deserialize(response["Attributes"])
+        return response
+
+def table(table_name):
+    return Table(table_name)
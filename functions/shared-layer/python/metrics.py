@@ -0,0 +1,97 @@
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# CloudWatch Embedded Metric Format: metrics are printed as structured log lines,
+# CloudWatch extracts them from the function logs, no PutMetricData call is made
+METRICS_ENABLED   = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "PollyPreviewSimple")
+FUNCTION_NAME     = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+
+# share of the routine logs that is printed, failures are always printed
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.1))
+LOG_MAX_CHARS   = int(os.environ.get("LOG_MAX_CHARS", 2048))
+
+# EMF accepts at most 100 values per metric in a single document
+MAX_VALUES = 100
+
+# {stage: {(metric name, unit): [values]}}, flushed once per invocation
+_values = {}
+_lock = threading.Lock()
+
+def put(name, value, unit="Milliseconds", stage="handler"):
+    with _lock:
+        _values.setdefault(stage, {}).setdefault((name, unit), []).append(value)
+
+def count(name, value=1, stage="handler"):
+    put(name, value, unit="Count", stage=stage)
+
+def size(name, value, stage="handler"):
+    put(name, value, unit="Bytes", stage=stage)
+
+@contextmanager
+def timer(stage, name="Duration"):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        put(name, (time.perf_counter() - started) * 1000, stage=stage)
+
+def stage_hook(stage_name, record, seconds):
+    # pipeline hook: hook(stage_name, record, seconds)
+    put("Duration", seconds * 1000, stage=stage_name)
+
+def document(stage, metrics):
+    # one EMF document for the metrics of a stage, dimensions Function and Stage
+    names = sorted(metrics)
+    doc = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["Function", "Stage"]],
+                "Metrics": [{"Name": name, "Unit": unit} for name, unit in names]
+            }]
+        },
+        "Function": FUNCTION_NAME,
+        "Stage": stage
+    }
+    for name, unit in names:
+        values = metrics[(name, unit)]
+        doc[name] = values[0] if len(values) == 1 else values
+    return doc
+
+def flush():
+    # prints every metric collected since the last flush, call it once before a handler returns
+    with _lock:
+        collected = dict(_values)
+        _values.clear()
+
+    if not METRICS_ENABLED:
+        return
+
+    for stage, metrics in collected.items():
+        # metrics with more values than a document takes are split across documents
+        while metrics:
+            chunk = {key: values[:MAX_VALUES] for key, values in metrics.items()}
+            print(json.dumps(document(stage, chunk), default=str))
+            metrics = {key: values[MAX_VALUES:] for key, values in metrics.items() if len(values) > MAX_VALUES}
+
+def _default(obj):
+    # records of the post-production pipeline, Decimals from DynamoDB, anything else as text
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    return str(obj)
+
+def log(label, obj=None, always=False):
+    # sampled and bounded replacement for printing whole objects
+    if not always and random.random() >= LOG_SAMPLE_RATE:
+        return
+
+    text = obj if isinstance(obj, str) else json.dumps(obj, default=_default)
+    if len(text) > LOG_MAX_CHARS:
+        text = text[:LOG_MAX_CHARS] + f"... ({len(text) - LOG_MAX_CHARS} more chars)"
+    print(f"{label}: {text}")
@@ -0,0 +1,120 @@
+import copy
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple
+
+TEMPLATES_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# where each output group type keeps its destination
+DESTINATION_SETTINGS = {
+    'FILE_GROUP_SETTINGS': 'FileGroupSettings',
+    'HLS_GROUP_SETTINGS': 'HlsGroupSettings'
+}
+
+@dataclass(frozen=True)
+class ImageSlot:
+    # s3 path of the overlay, timings are left as in the template when None
+    image: str
+    start_time: Optional[str] = None
+    duration_ms: Optional[int] = None
+
+@dataclass(frozen=True)
+class JobParameters:
+    file_input: str
+    audio: str
+    images: Tuple[ImageSlot, ...]
+    destination: str
+    captions: Optional[str] = None
+    end_timecode: Optional[str] = None
+    name_modifier: Optional[str] = None
+
+def validate_template(name, settings):
+    # fails at cold start rather than on the first record
+    try:
+        job_input = settings['Inputs'][0]
+        job_input['ImageInserter']['InsertableImages']
+        job_input['AudioSelectors']['Audio Selector 1']
+        output_groups = settings['OutputGroups']
+    except (KeyError, IndexError, TypeError) as e:
+        raise ValueError(f"{name}: missing job setting {e}")
+
+    for output_group in output_groups:
+        group_type = output_group['OutputGroupSettings']['Type']
+        if group_type not in DESTINATION_SETTINGS:
+            raise ValueError(f"{name}: unknown output group type {group_type}")
+
+@lru_cache(maxsize=None)
+def load_template(name):
+    # loaded, validated and cached once per container: never mutate the returned dict
+    with open(os.path.join(TEMPLATES_PATH, name)) as fp:
+        settings = json.load(fp)
+    validate_template(name, settings)
+    return settings
+
+def set_image_geometry(settings, width, height, x=None, y=None):
+    # returns a copy of the template with every image slot resized (and moved)
+    settings = copy.deepcopy(settings)
+    for slot in settings['Inputs'][0]['ImageInserter']['InsertableImages']:
+        slot['Width'] = width
+        slot['Height'] = height
+        if x is not None:
+            slot['ImageX'] = x
+        if y is not None:
+            slot['ImageY'] = y
+    return settings
+
+def set_burnin(settings, **burnin_settings):
+    # returns a copy of the template with the burn-in captions of the first output updated
+    settings = copy.deepcopy(settings)
+    caption = settings['OutputGroups'][0]['Outputs'][0]['CaptionDescriptions'][0]
+    caption['DestinationSettings']['BurninDestinationSettings'].update(burnin_settings)
+    return settings
+
+def build(template, params):
+    # copies a compiled template and patches in the values of a single job
+    settings = copy.deepcopy(template)
+    job_input = settings['Inputs'][0]
+
+    job_input['FileInput'] = params.file_input
+    job_input['AudioSelectors']['Audio Selector 1']['ExternalAudioFileInput'] = params.audio
+
+    if params.end_timecode is not None:
+        job_input['InputClippings'][0]['EndTimecode'] = params.end_timecode
+
+    if params.captions is not None:
+        job_input['CaptionSelectors']['Captions Selector 1']['SourceSettings']['FileSourceSettings']['SourceFile'] = params.captions
+
+    # one template slot per image, extra slots are dropped so short articles still work,
+    # missing ones are copied from the last slot of the template, each on its own layer
+    slots = job_input['ImageInserter']['InsertableImages'][:len(params.images)]
+    while slots and len(slots) < len(params.images):
+        slot = copy.deepcopy(slots[-1])
+        slot['Layer'] = len(slots)
+        slots.append(slot)
+    for slot, image in zip(slots, params.images):
+        slot['ImageInserterInput'] = image.image
+        if image.start_time is not None:
+            slot['StartTime'] = image.start_time
+        if image.duration_ms is not None:
+            slot['Duration'] = image.duration_ms
+    if slots:
+        job_input['ImageInserter']['InsertableImages'] = slots
+    else:
+        del job_input['ImageInserter']
+
+    for output_group in settings['OutputGroups']:
+        group_settings = output_group['OutputGroupSettings']
+        group_settings[DESTINATION_SETTINGS[group_settings['Type']]]['Destination'] = params.destination
+
+        if params.name_modifier is not None:
+            outputs = output_group['Outputs']
+            if len(outputs) == 1:
+                outputs[0]['NameModifier'] = params.name_modifier
+            else:
+                # renditions of a ladder keep their own suffix, so their names stay distinct
+                for output in outputs:
+                    output['NameModifier'] = params.name_modifier + output.get('NameModifier', '')
+
+    return settings
@@ -0,0 +1,113 @@
+import copy
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Tuple
+
+TEMPLATES_PATH = os.path.dirname(os.path.abspath(__file__))
+
+@dataclass(frozen=True)
+class Rung:
+    # one rendition of the ladder, Name ends up in its playlist name
+    name: str
+    width: int
+    height: int
+    bitrate: int
+
+@dataclass(frozen=True)
+class Profile:
+    rungs: Tuple[Rung, ...]
+    segment_length: int
+    min_segment_length: int
+    gop_seconds: float
+    iframe_only_playlist: bool
+
+def parse_profile(name, document):
+    # fails at cold start rather than on the first record
+    try:
+        rungs = tuple(
+            Rung(rung['Name'], int(rung['Width']), int(rung['Height']), int(rung['Bitrate']))
+            for rung in document['Rungs']
+        )
+        profile = Profile(
+            rungs=rungs,
+            segment_length=int(document['SegmentLength']),
+            min_segment_length=int(document.get('MinSegmentLength', 0)),
+            gop_seconds=float(document.get('GopSeconds', 2)),
+            iframe_only_playlist=bool(document.get('IFrameOnlyPlaylist', False))
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"{name}: invalid ladder profile {e!r}")
+
+    if not rungs:
+        raise ValueError(f"{name}: the ladder has no rungs")
+    if len({rung.name for rung in rungs}) != len(rungs):
+        raise ValueError(f"{name}: rung names must be unique")
+    for rung in rungs:
+        # H.264 with 4:2:0 chroma needs even dimensions
+        if rung.width <= 0 or rung.height <= 0 or rung.width % 2 or rung.height % 2 or rung.bitrate <= 0:
+            raise ValueError(f"{name}: invalid rung {rung}")
+    if profile.segment_length <= 0 or profile.gop_seconds <= 0:
+        raise ValueError(f"{name}: segment length and GOP must be positive")
+    if profile.segment_length % profile.gop_seconds:
+        raise ValueError(f"{name}: segments of {profile.segment_length}s don't start on a GOP of {profile.gop_seconds}s")
+
+    return profile
+
+@lru_cache(maxsize=None)
+def load_profile(name):
+    with open(os.path.join(TEMPLATES_PATH, name)) as fp:
+        return parse_profile(name, json.load(fp))
+
+def select(profile, names):
+    # the rungs named in names (all of them when empty), lowest bitrate first:
+    # players start on the first variant of the master playlist, the smallest one starts fastest
+    if names:
+        by_name = {rung.name: rung for rung in profile.rungs}
+        unknown = [name for name in names if name not in by_name]
+        if unknown:
+            raise ValueError(f"unknown ladder rungs {unknown}, the profile has {list(by_name)}")
+        rungs = [by_name[name] for name in names]
+    else:
+        rungs = list(profile.rungs)
+    return sorted(rungs, key=lambda rung: rung.bitrate)
+
+def apply(settings, profile, rungs):
+    # returns a copy of the template whose HLS output groups have one output per rung,
+    # each a copy of the group's first output with the resolution and bitrate of its rung
+    settings = copy.deepcopy(settings)
+    for output_group in settings['OutputGroups']:
+        group_settings = output_group['OutputGroupSettings']
+        if group_settings['Type'] != 'HLS_GROUP_SETTINGS':
+            continue
+
+        hls_settings = group_settings['HlsGroupSettings']
+        hls_settings['SegmentLength'] = profile.segment_length
+        hls_settings['MinSegmentLength'] = profile.min_segment_length
+        # players pick a variant by its resolution and codecs, both listed in the master playlist
+        hls_settings['StreamInfResolution'] = 'INCLUDE'
+        hls_settings['CodecSpecification'] = 'RFC_4281'
+
+        base_output = output_group['Outputs'][0]
+        outputs = []
+        for rung in rungs:
+            output = copy.deepcopy(base_output)
+            output['NameModifier'] = f"_{rung.name}"
+
+            video = output['VideoDescription']
+            video['Width'] = rung.width
+            video['Height'] = rung.height
+            h264 = video['CodecSettings']['H264Settings']
+            h264['Bitrate'] = rung.bitrate
+            # a keyframe at every segment boundary, so renditions can be switched between segments
+            h264['GopSize'] = profile.gop_seconds
+            h264['GopSizeUnits'] = 'SECONDS'
+
+            if profile.iframe_only_playlist:
+                # keyframe-only playlist for each rendition, used by players for scrubbing and trick play
+                output.setdefault('OutputSettings', {}).setdefault('HlsSettings', {})['IFrameOnlyManifest'] = 'INCLUDE'
+            outputs.append(output)
+
+        output_group['Outputs'] = outputs
+    return settings
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+# a claim is pending until its job is created: if the invocation dies in between (timeout,
+# crash), the claim expires after this many seconds and a redelivery may submit the job again
+# keep it longer than the function timeout
+VIDEO_JOB_LEASE = int(os.environ.get('VIDEO_JOB_LEASE', 120))
+
+# per job type, stored on the asset item of the metadata store: the fingerprint of the
+# job inputs, when a pending claim expires, and the id of the job once it's created
+FINGERPRINT_ATTRIBUTES = {
+    'previewJob': 'PreviewJobFingerprint',
+    'fullJob': 'FullJobFingerprint'
+}
+LEASE_ATTRIBUTES = {
+    'previewJob': 'PreviewJobLeaseExpires',
+    'fullJob': 'FullJobLeaseExpires'
+}
+JOB_ID_ATTRIBUTES = {
+    'previewJob': 'PreviewJobId',
+    'fullJob': 'FullJobId'
+}
+
+def fingerprint(request):
+    # hash of the effective job inputs: audio, images, template, timings and destinations
+    # all end up in the settings, so the same settings mean the same video
+    payload = json.dumps(
+        {'Role': request['Role'], 'Settings': request['Settings']},
+        sort_keys=True, separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def attribute_names(job_name):
+    return {
+        '#fingerprint': FINGERPRINT_ATTRIBUTES[job_name],
+        '#lease': LEASE_ATTRIBUTES[job_name],
+        '#job': JOB_ID_ATTRIBUTES[job_name]
+    }
+
+def claim(dynamodb, table, asset_id, job_name, job_fingerprint):
+    # records a pending claim on the fingerprint unless the same job was already created
+    # or another invocation holds an unexpired claim on it, returns False for a duplicate
+    now = int(time.time())
+    try:
+        dynamodb.update_item(
+            TableName=table,
+            Key={'AssetId': {'S': asset_id}},
+            UpdateExpression='SET #fingerprint = :fingerprint, #lease = :expires REMOVE #job',
+            ConditionExpression='attribute_not_exists(#fingerprint) OR #fingerprint <> :fingerprint OR #lease < :now',
+            ExpressionAttributeNames=attribute_names(job_name),
+            ExpressionAttributeValues={
+                ':fingerprint': {'S': job_fingerprint},
+                ':expires': {'N': str(now + VIDEO_JOB_LEASE)},
+                ':now': {'N': str(now)}
+            }
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        # the ledger being unavailable must not cost a video
+        print(e)
+    return True
+
+def commit(dynamodb, table, asset_id, job_name, job_fingerprint, job_id):
+    # the job was created: the claim no longer expires, and records which job it was
+    try:
+        dynamodb.update_item(
+            TableName=table,
+            Key={'AssetId': {'S': asset_id}},
+            UpdateExpression='SET #job = :job REMOVE #lease',
+            ConditionExpression='#fingerprint = :fingerprint',
+            ExpressionAttributeNames=attribute_names(job_name),
+            ExpressionAttributeValues={
+                ':fingerprint': {'S': job_fingerprint},
+                ':job': {'S': job_id}
+            }
+        )
+    except ClientError as e:
+        print(e)
+
+def release(dynamodb, table, asset_id, job_name, job_fingerprint):
+    # forgets a claim whose job could not be submitted, so a retry goes through
+    try:
+        dynamodb.update_item(
+            TableName=table,
+            Key={'AssetId': {'S': asset_id}},
+            UpdateExpression='REMOVE #fingerprint, #lease',
+            ConditionExpression='#fingerprint = :fingerprint',
+            ExpressionAttributeNames={
+                '#fingerprint': FINGERPRINT_ATTRIBUTES[job_name],
+                '#lease': LEASE_ATTRIBUTES[job_name]
+            },
+            ExpressionAttributeValues={':fingerprint': {'S': job_fingerprint}}
+        )
+    except ClientError as e:
+        print(e)
+
+def claim_all(dynamodb, table, entries, max_workers=8):
+    # entries = [(asset_id, job_name, job_fingerprint), ...], results in the same order
+    if not entries:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(entries))) as executor:
+        return list(executor.map(lambda entry: claim(dynamodb, table, *entry), entries))
@@ -0,0 +1,132 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError, EndpointConnectionError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+
+import metrics
+
+MEDIACONVERT_MAX_CONCURRENCY = int(os.environ.get('MEDIACONVERT_MAX_CONCURRENCY', 8))
+# CreateJob requests per second, the bucket halves it on throttling and slowly grows it back
+MEDIACONVERT_MAX_RATE = float(os.environ.get('MEDIACONVERT_MAX_RATE', 10))
+MEDIACONVERT_MIN_RATE = float(os.environ.get('MEDIACONVERT_MIN_RATE', 0.5))
+MEDIACONVERT_MAX_ATTEMPTS = int(os.environ.get('MEDIACONVERT_MAX_ATTEMPTS', 6))
+MEDIACONVERT_BACKOFF_BASE = float(os.environ.get('MEDIACONVERT_BACKOFF_BASE', 0.25))
+MEDIACONVERT_BACKOFF_CAP = float(os.environ.get('MEDIACONVERT_BACKOFF_CAP', 8))
+# no new attempt or wait is started when less than this is left of the invocation
+MEDIACONVERT_DEADLINE_MARGIN = float(os.environ.get('MEDIACONVERT_DEADLINE_MARGIN', 1))
+
+THROTTLING_CODES = ('TooManyRequestsException', 'ThrottlingException', 'Throttling')
+# retried as well, without slowing down the bucket
+TRANSIENT_CODES = ('InternalServerErrorException', 'ServiceUnavailableException')
+# what an account endpoint that went stale answers, the endpoint is discovered again
+STALE_ENDPOINT_CODES = ('ForbiddenException', 'NotFoundException')
+
+class TokenBucket:
+    # adaptive token bucket: multiplicative decrease on throttling, additive increase on success
+
+    def __init__(self, max_rate, min_rate):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.tokens = self.capacity()
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def capacity(self):
+        # burst size follows the rate, but always holds at least one token:
+        # below one request per second the bucket must still fill up to a whole request
+        return max(1.0, self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity(), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, deadline=None):
+        # returns False, without taking a token, when the wait would go past deadline (time.monotonic())
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, self.capacity())
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+# module level, so what was learnt about the account quota survives warm invocations
+bucket = TokenBucket(MEDIACONVERT_MAX_RATE, MEDIACONVERT_MIN_RATE)
+
+def is_throttling(error):
+    return isinstance(error, ClientError) and error.response['Error']['Code'] in THROTTLING_CODES
+
+def is_retryable(error):
+    # connection errors and timeouts included: the client doesn't retry anything on its own
+    return is_throttling(error) or isinstance(error, (BotoConnectionError, HTTPClientError)) or (
+        isinstance(error, ClientError) and error.response['Error']['Code'] in TRANSIENT_CODES
+    )
+
+def is_stale_endpoint(error):
+    return isinstance(error, EndpointConnectionError) or (
+        isinstance(error, ClientError) and error.response['Error']['Code'] in STALE_ENDPOINT_CODES
+    )
+
+def deadline_from(context):
+    # time.monotonic() past which no attempt is started, None without a Lambda context
+    if context is None:
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - MEDIACONVERT_DEADLINE_MARGIN
+
+def out_of_time(deadline, seconds=0):
+    return deadline is not None and time.monotonic() + seconds > deadline
+
+def backoff(attempt):
+    # full jitter
+    return random.uniform(0, min(MEDIACONVERT_BACKOFF_CAP, MEDIACONVERT_BACKOFF_BASE * 2 ** attempt))
+
+def create_job(client, request, deadline=None):
+    # request = {"Role": ..., "UserMetadata": ..., "Settings": ...}
+    # returns {"statusCode": 200, "job": ...} or {"statusCode": 500, "error": ..., "stale_endpoint": ...}
+    # gives up before deadline rather than being cut off by the function timeout
+    for attempt in range(MEDIACONVERT_MAX_ATTEMPTS):
+        if not bucket.acquire(deadline):
+            metrics.count('DeadlineExceeded', stage='create_job')
+            return {'statusCode': 500, 'error': 'out of time waiting for the request rate', 'stale_endpoint': False}
+        metrics.count('Attempts', stage='create_job')
+        try:
+            with metrics.timer('create_job'):
+                job = client.create_job(**request)
+            bucket.succeeded()
+            return {'statusCode': 200, 'job': job}
+
+        except (ClientError, BotoCoreError) as e:
+            if is_throttling(e):
+                metrics.count('Throttles', stage='create_job')
+                bucket.throttled()
+            wait = backoff(attempt)
+            if is_retryable(e) and attempt + 1 < MEDIACONVERT_MAX_ATTEMPTS and not out_of_time(deadline, wait):
+                time.sleep(wait)
+                continue
+            return {'statusCode': 500, 'error': str(e), 'stale_endpoint': is_stale_endpoint(e)}
+
+def create_jobs(client, requests, deadline=None):
+    # submits every request concurrently, results are returned in the same order
+    if not requests:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(MEDIACONVERT_MAX_CONCURRENCY, len(requests))) as executor:
+        return list(executor.map(lambda request: create_job(client, request, deadline), requests))
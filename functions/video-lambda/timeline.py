@@ -0,0 +1,57 @@
+import math
+import os
+
+# frame rate of the template videos, timecodes are frame accurate against it
+VIDEO_FRAMERATE = int(os.environ.get('VIDEO_FRAMERATE', 24))
+
+# MediaConvert accepts at most 20 insertable images per input
+MAX_INSERTABLE_IMAGES = 20
+
+def timecode(frame, fps=VIDEO_FRAMERATE):
+    # HH:MM:SS:FF
+    seconds, frames = divmod(frame, fps)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%02d:%02d:%02d:%02d' % (hours, minutes, seconds, frames)
+
+def end_timecode(duration_seconds, fps=VIDEO_FRAMERATE):
+    # end of the input clipping, the first whole second after the narration
+    return timecode((int(duration_seconds) + 1) * fps, fps)
+
+def weights_from_positions(positions, text_length):
+    # each image is weighted by the amount of text between it and the next one,
+    # positions are character offsets of the images in the article text
+    #   the first image is on screen from the start of the narration, so the text before it
+    #   is its share too: the next image then appears when its own text is narrated
+    boundaries = [0] + list(positions[1:]) + [text_length]
+    return [max(end - start, 0) for start, end in zip(boundaries, boundaries[1:])]
+
+def schedule(duration_seconds, count, weights=None, fps=VIDEO_FRAMERATE):
+    # splits the narration in `count` consecutive slots proportional to weights,
+    # returns [(start timecode, duration in ms), ...]
+    #   boundaries are rounded on the cumulative weight, so the slots cover every frame
+    #   of the narration and no remainder is dropped
+    count = min(count, MAX_INSERTABLE_IMAGES)
+    if count <= 0:
+        return []
+
+    if not weights or len(weights) < count or sum(weights[:count]) <= 0:
+        weights = [1] * count
+    weights = weights[:count]
+
+    total_frames = math.ceil(float(duration_seconds) * fps)
+    total_weight = sum(weights)
+
+    boundaries = [0]
+    cumulative = 0
+    for weight in weights:
+        cumulative += weight
+        boundaries.append(round(total_frames * cumulative / total_weight))
+
+    # durations are in ms, taken between rounded boundaries so they never drift
+    to_ms = lambda frame: round(frame * 1000 / fps)
+
+    return [
+        (timecode(start, fps), to_ms(end) - to_ms(start))
+        for start, end in zip(boundaries, boundaries[1:])
+    ]
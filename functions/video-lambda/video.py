@@ -2,61 +2,273 @@ import glob
 import json
 import os
 import uuid
-import boto3
 import datetime
 import random
+import threading
+import time
 from urllib.parse import urlparse
 import logging
 from datetime import timedelta
 
-from botocore.client import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+import batch
+import clients
+import job_settings
+import ladder
+import ledger
+import metrics
+import submit
+import timeline
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3 = boto3.resource('s3')
+# created on first use, see clients.py in the shared layer
+s3 = clients.lazy('s3')
+dynamodb = clients.lazy('dynamodb')
+
+POLLY_METADATA_STORE = os.environ.get('POLLY_METADATA_STORE')
+# record a fingerprint of every submitted job and skip duplicate submissions
+VIDEO_JOB_LEDGER = os.environ.get('VIDEO_JOB_LEDGER', 'true').lower() == 'true' and POLLY_METADATA_STORE is not None
+
+# geometry of the InsertableImages slots, post-production resizes the images to match
+IMAGE_SLOT_WIDTH  = int(os.environ.get('IMAGE_SLOT_WIDTH', 1100))
+IMAGE_SLOT_HEIGHT = int(os.environ.get('IMAGE_SLOT_HEIGHT', 800))
+# images shown in the full video, up to MediaConvert's insertable images limit
+IMAGES_MAX_COUNT = min(int(os.environ.get('IMAGES_MAX_COUNT', 4)), timeline.MAX_INSERTABLE_IMAGES)
+
+# job settings templates, compiled once per container and copied for every job
+PREVIEW_TEMPLATE = job_settings.set_burnin(
+    job_settings.set_image_geometry(
+        job_settings.load_template('preview_mp4.json'),
+        IMAGE_SLOT_WIDTH, IMAGE_SLOT_HEIGHT, x=10, y=10
+    ),
+    FontColor="BLACK",
+    YPosition=900
+)
+FULL_TEMPLATE = job_settings.set_image_geometry(
+    job_settings.load_template('full_hls.json'),
+    IMAGE_SLOT_WIDTH, IMAGE_SLOT_HEIGHT
+)
+
+# adaptive bitrate HLS for the full video: one rendition per rung of the ladder profile,
+# HLS_LADDER_RUNGS picks rungs by name (e.g. "360p,720p"), all of the profile when empty
+HLS_LADDER = os.environ.get('HLS_LADDER', 'true').lower() == 'true'
+HLS_LADDER_PROFILE = os.environ.get('HLS_LADDER_PROFILE', 'ladder.json')
+HLS_LADDER_RUNGS = [name.strip() for name in os.environ.get('HLS_LADDER_RUNGS', '').split(',') if name.strip()]
+
+if HLS_LADDER:
+    LADDER_PROFILE = ladder.load_profile(HLS_LADDER_PROFILE)
+    FULL_TEMPLATE = ladder.apply(FULL_TEMPLATE, LADDER_PROFILE, ladder.select(LADDER_PROFILE, HLS_LADDER_RUNGS))
+
+# account specific MediaConvert endpoint: when set, DescribeEndpoints is never called
+MEDIACONVERT_ENDPOINT = os.environ.get('MEDIACONVERT_ENDPOINT')
+MEDIACONVERT_ENDPOINT_TTL = int(os.environ.get('MEDIACONVERT_ENDPOINT_TTL', 3600))
+
+# module level, so the discovered endpoint and its client survive warm invocations
+mediaconvert_cache = {
+    'client': None,
+    'endpoint': None,
+    'expires_at': 0
+}
+mediaconvert_cache_lock = threading.Lock()
+
+def get_mediaconvert_client(region):
+    with mediaconvert_cache_lock:
+        if mediaconvert_cache['client'] is not None and time.monotonic() < mediaconvert_cache['expires_at']:
+            return mediaconvert_cache['client']
+        
+        if MEDIACONVERT_ENDPOINT:
+            endpoint = MEDIACONVERT_ENDPOINT
+            expires_at = float('inf')
+        else:
+            endpoints = clients.client('mediaconvert', region_name=region).describe_endpoints()
+            endpoint = endpoints['Endpoints'][0]['Url']
+            expires_at = time.monotonic() + MEDIACONVERT_ENDPOINT_TTL
+        
+        logger.info('MediaConvert endpoint: %s', endpoint)
+        
+        # every retry happens in the submit module: throttling with a rate shared by every
+        # request, transient and connection errors with backoff, all within the invocation
+        mediaconvert_cache['client'] = clients.create(
+            'mediaconvert',
+            region_name=region,
+            endpoint_url=endpoint,
+            verify=False,
+            config=Config(retries={'max_attempts': 0})
+        )
+        mediaconvert_cache['endpoint'] = endpoint
+        mediaconvert_cache['expires_at'] = expires_at
+        
+        return mediaconvert_cache['client']
+
+def invalidate_mediaconvert_client():
+    # the next call discovers the endpoint again
+    with mediaconvert_cache_lock:
+        mediaconvert_cache['client'] = None
+        mediaconvert_cache['endpoint'] = None
+        mediaconvert_cache['expires_at'] = 0
 
-def humanize_time(secs):
-    mins, secs = divmod(secs, 60)
-    hours, mins = divmod(mins, 60)
-    return '%02d:%02d:%02d' % (hours, mins, secs)
-    
 def is_successful_ops(job_output):
     return job_output['statusCode'] == 200
 
 def is_failed_ops(job_output):
     return job_output['statusCode'] != 200
 
+def summarize(record, job_output):
+    # job ids, or why a job was skipped, instead of the whole job
+    jobs = json.loads(job_output['body'])
+    return batch.summary(
+        record['s3']['object']['key'],
+        is_successful_ops(job_output),
+        Jobs={name: job.get('Job', {}).get('Id') or job.get('Skipped') for name, job in jobs.items() if job}
+    )
+
 def handler(event, context):
     
-    job_outputs = [
-        create_media_convert_jobs(record) for record in event['Records']
-    ]
+    # S3 records come straight from the bucket, or wrapped in SQS messages
+    records, message_ids, unreadable = batch.unwrap(event)
+    
+    # the preview and full jobs of every record are submitted together
+    job_outputs = submit_media_convert_jobs([
+        prepare_media_convert_jobs(record) for record in records
+    ], submit.deadline_from(context))
     
-    successful_ops = [
-        is_successful_ops(job_output) for job_output in job_outputs
-    ]
     failed_ops =[
         is_failed_ops(job_output) for job_output in job_outputs
     ]
     
-    return {
-        'statusCode': 200,
-        'body': json.dumps(
-            {
-                "JobOutputs":job_outputs,
-                "FailedOps": failed_ops,
-                "SuccessfulOps": successful_ops
-                
-            }, 
-            indent=4, sort_keys=True, default=str
-        )
-    }
+    metrics.count('Records', len(job_outputs))
+    metrics.count('Failed', sum(failed_ops))
+    metrics.flush()
     
+    return batch.response(
+        event,
+        message_ids,
+        [summarize(record, job_output) for record, job_output in zip(records, job_outputs)],
+        unreadable
+    )
+    
+
+def get_image_weights(json_content):
+    # explicit weights win, otherwise images are weighted by the text that follows them
+    #   ImagePositions come from the scrape step (scrape.js), ImagesLambda keeps one offset in Text
+    #   per path of PostProducedImagesS3Paths
+    #   ImageWeights is opt-in: nothing in the pipeline sets it, a metadata store item can carry it
+    # without either of them, every image gets the same time on screen
+    metadata = json_content.get('Metadata', {})
+    if metadata.get('ImageWeights'):
+        return [float(weight) for weight in metadata['ImageWeights']]
+    
+    # compact triggers carry the text length, full ones the whole text
+    article_body = json_content.get('ArticleBody', {})
+    text_length = article_body.get('TextLength') or len(article_body.get('Text', ''))
+    if article_body.get('ImagePositions') and text_length:
+        return timeline.weights_from_positions(article_body['ImagePositions'], text_length)
+    
+    return None
 
 def create_media_convert_jobs(record):
+    return submit_media_convert_jobs([prepare_media_convert_jobs(record)])[0]
+
+def prepare_media_convert_jobs(record):
+    # returns the create_job requests of a record, keyed by job name,
+    # or None if the record could not be read
+    try:
+        with metrics.timer('build_jobs'):
+            return build_media_convert_jobs(record)
+    except Exception as e:
+        logger.error('Exception: %s', e)
+        return None
+
+def submit_media_convert_jobs(prepared_jobs, deadline=None):
+    region = os.environ['AWS_DEFAULT_REGION']
+    
+    # (asset id, job name, request) of every job, in record order
+    entries = [
+        (request['UserMetadata']['assetID'], name, request)
+        for jobs in prepared_jobs if jobs is not None
+        for name, request in jobs.items()
+    ]
+    fingerprints = [ledger.fingerprint(request) for _, _, request in entries]
+    
+    # S3 events are delivered at least once: jobs whose inputs were already submitted are skipped
+    if VIDEO_JOB_LEDGER:
+        with metrics.timer('ledger'):
+            claimed = ledger.claim_all(dynamodb, POLLY_METADATA_STORE, [
+                (asset_id, name, fingerprint)
+                for (asset_id, name, _), fingerprint in zip(entries, fingerprints)
+            ])
+        metrics.count('Duplicates', claimed.count(False), stage='ledger')
+    else:
+        claimed = [True] * len(entries)
+    
+    requests = [request for (_, _, request), is_claimed in zip(entries, claimed) if is_claimed]
+    
+    try:
+        client = get_mediaconvert_client(region)
+        submitted = iter(submit.create_jobs(client, requests, deadline))
+    except (ClientError, BotoCoreError) as e:
+        logger.error('Exception: %s', e)
+        submitted = iter([{'statusCode': 500, 'error': str(e), 'stale_endpoint': False}] * len(requests))
+    
+    results = []
+    for (asset_id, name, _), fingerprint, is_claimed in zip(entries, fingerprints, claimed):
+        if not is_claimed:
+            logger.info('Skipping duplicate %s for %s', name, asset_id)
+            results.append({'statusCode': 200, 'job': {'Skipped': 'DUPLICATE', 'Fingerprint': fingerprint}})
+            continue
+        
+        result = next(submitted)
+        if VIDEO_JOB_LEDGER:
+            # a created job settles the claim, a failed one gives it back for the retry
+            if result['statusCode'] == 200:
+                ledger.commit(dynamodb, POLLY_METADATA_STORE, asset_id, name, fingerprint, result['job']['Job']['Id'])
+            else:
+                ledger.release(dynamodb, POLLY_METADATA_STORE, asset_id, name, fingerprint)
+        results.append(result)
+    
+    results = iter(results)
+    
+    job_outputs = []
+    endpoint_failed = False
+    
+    for jobs in prepared_jobs:
+        if jobs is None:
+            job_outputs.append({
+                'statusCode': 500,
+                'body': json.dumps({"previewJob":{}, "fullJob":{}}, indent=4, sort_keys=True, default=str)
+            })
+            continue
+        
+        statusCode = 200
+        body = {}
+        for name in jobs:
+            result = next(results)
+            if result['statusCode'] == 200:
+                body[name] = result['job']
+            else:
+                logger.error('Exception: %s', result['error'])
+                body[name] = {}
+                statusCode = 500
+                endpoint_failed = endpoint_failed or result['stale_endpoint']
+        
+        job_outputs.append({
+            'statusCode': statusCode,
+            'body': json.dumps(body, indent=4, sort_keys=True, default=str)
+        })
+    
+    # the endpoint itself failed (unreachable, or gone from the account): discover it again
+    if endpoint_failed:
+        invalidate_mediaconvert_client()
+    
+    return job_outputs
+
+def build_media_convert_jobs(record):
    
-    print(record)
+    metrics.log('record', record)
     
     article_name = record['s3']['object']['key']
     article = urlparse(article_name)
@@ -74,44 +286,25 @@ def create_media_convert_jobs(record):
     templateS3URL = os.environ.get('TEMPLATE_S3_URL', 's3://gbatt-blogs/narratives/template.mov')
     templateS3URL_preview = os.environ.get('TEMPLATE_S3_URL_PREVIEW', 's3://gbatt-blogs/narratives/Template_video_right.mov')
     
-    # reading the article json
-    content_object = s3.Object(sourceS3Bucket, article_name)
-    file_content = content_object.get()['Body'].read().decode('utf-8')
-    json_content = json.loads(file_content)
+    # reading the trigger json, json.load reads the whole body before parsing it:
+    # compact triggers are a few hundred bytes, so there is nothing to gain from an incremental parser
+    content_object = s3.get_object(Bucket=sourceS3Bucket, Key=article_name)
+    json_content = json.load(content_object['Body'])
     
     audiopreview = (json_content['Metadata']['AudioPreview'])
-    photopreview1 = (json_content['Metadata']['PostProducedImagesS3Paths'][0])
-    photopreview2 = (json_content['Metadata']['PostProducedImagesS3Paths'][1])
-    photopreview3 = (json_content['Metadata']['PostProducedImagesS3Paths'][2])
-    photopreview4 = (json_content['Metadata']['PostProducedImagesS3Paths'][3])
+    photos = (json_content['Metadata']['PostProducedImagesS3Paths'][:IMAGES_MAX_COUNT])
     audiofull = (json_content['Metadata']['FullNarration'])
     narrationlenght = (json_content['Metadata']['FullNarrationDurationInSeconds'])
+    
+    # the preview template has four fixed slots for its 30 seconds
+    photopreviews = photos[:4]
+    
+    # full video: each image gets a share of the narration proportional to its weight
+    imagetimesfull = timeline.schedule(narrationlenght, len(photos), get_image_weights(json_content))
+    fullvideolenght = timeline.end_timecode(float(narrationlenght))
 
-    f = int(float(narrationlenght))
-    partial=f//4
-
-    framerate1=partial
-    framerate2=framerate1+partial
-    framerate3=framerate2+partial
-    framerate4=framerate3+partial
-   
-    imagetimefull1=humanize_time(framerate1)+":00"
-    imagetimefull2=humanize_time(framerate2)+":00"
-    imagetimefull3=humanize_time(framerate3)+":00"
-    imagetimefull4=humanize_time(framerate4)+":00"
-    fullvideolenght = humanize_time(f+1)+":00"
-
-    destinationS3 = f"s3://{os.environ['DestinationBucket']}"
     mediaConvertRole = os.environ['MediaConvertRole']
     application = os.environ['Application']
-    region = os.environ['AWS_DEFAULT_REGION']
-    statusCode = 200
-    
-    jobs = []
-    jobsfull = []
-    
-    job = {}
-    jobfull = {}
     
     # Use MediaConvert SDK UserMetadata to tag jobs with the assetID
     # Events from MediaConvert will have the assetID in UserMedata
@@ -119,173 +312,50 @@ def create_media_convert_jobs(record):
     jobMetadata['assetID'] = assetID
     jobMetadata['application'] = application
     jobMetadata['input'] = templateS3URL_preview
+    jobMetadata['settings'] = 'Default'
     
     jobMetadatafull = {}
     jobMetadatafull['assetID'] = assetIDfull
     jobMetadatafull['application'] = application
     jobMetadatafull['input'] = templateS3URL
-
-    try:    
-
-        # Build a list of jobs to run against the input by using the default job in this folder.
-        jobInput = {}
-        jobInputfull = {}
-
-        bucket = s3.Bucket(sourceS3Bucket)
+    jobMetadatafull['settings'] = 'Default'
     
-        # PREVIEW
-        with open('preview_mp4.json') as json_data:
-            jobInput['filename'] = 'Default'
-            logger.info('jobInput: %s', jobInput['filename'])
-            jobInput['settings'] = json.load(json_data)
-            logger.info(json.dumps(jobInput['settings']))
-
-            jobs.append(jobInput)
-        
-        # FULL VIDEO
-        with open('full_hls.json') as json_datafull:
-            jobInputfull['filename'] = 'Default'
-            logger.info('jobInputfull: %s', jobInputfull['filename'])
-            jobInputfull['settings'] = json.load(json_datafull)
-            logger.info(json.dumps(jobInputfull['settings']))
-
-            jobsfull.append(jobInputfull)
-        
-        endpoints = boto3.client('mediaconvert', region_name=region).describe_endpoints()
-
-        client = boto3.client('mediaconvert', region_name=region, endpoint_url=endpoints['Endpoints'][0]['Url'], verify=False)
-
-        for j in jobs:
-            jobSettings = j['settings']
-            jobFilename = j['filename']
-            # Save the name of the settings file in the job userMetadata
-            jobMetadata['settings'] = jobFilename
-
-            # Update the job settings with the source video from the S3 event
-            jobSettings['Inputs'][0]['FileInput'] = templateS3URL_preview
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][0]['ImageInserterInput'] = photopreview1
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][1]['ImageInserterInput'] = photopreview2
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][2]['ImageInserterInput'] = photopreview3
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][3]['ImageInserterInput'] = photopreview4
-            jobSettings['Inputs'][0]['AudioSelectors']['Audio Selector 1']['ExternalAudioFileInput'] = audiopreview
-            
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][0]['Width'] = 1100
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][1]['Width'] = 1100
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][2]['Width'] = 1100
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][3]['Width'] = 1100
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][0]['Height'] = 800
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][1]['Height'] = 800
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][2]['Height'] = 800
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][3]['Height'] = 800
-            
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][0]['ImageX'] = 10
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][1]['ImageX'] = 10
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][2]['ImageX'] = 10
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][3]['ImageX'] = 10
-            
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][0]['ImageY'] = 10
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][1]['ImageY'] = 10
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][2]['ImageY'] = 10
-            jobSettings['Inputs'][0]['ImageInserter']['InsertableImages'][3]['ImageY'] = 10
-            
-            jobSettings['Inputs'][0]['CaptionSelectors']['Captions Selector 1']['SourceSettings']['FileSourceSettings']['SourceFile'] = f"s3://{sourceS3Bucket}/srt/preview/{article}.srt"
-            jobSettings['OutputGroups'][0]['Outputs'][0]['CaptionDescriptions'][0]['DestinationSettings']['BurninDestinationSettings']['FontColor'] = "BLACK"
-            jobSettings['OutputGroups'][0]['Outputs'][0]['CaptionDescriptions'][0]['DestinationSettings']['BurninDestinationSettings']['YPosition'] = 900
-            
-            logger.info('SRT FILE PAHT')
-            logger.info(jobSettings['Inputs'][0]['CaptionSelectors']['Captions Selector 1']['SourceSettings']['FileSourceSettings']['SourceFile'])
-            # Update the job settings with the destination paths for converted videos.  We want to replace the
-            # destination bucket of the output paths in the job settings, but keep the rest of the
-            # path
-            destinationS3 = f"s3://{os.environ['DestinationBucket']}/output/preview/{filename}" 
-
-            for outputGroup in jobSettings['OutputGroups']:
-
-                logger.info("outputGroup['OutputGroupSettings']['Type'] == %s", outputGroup['OutputGroupSettings']['Type'])
-
-                if outputGroup['OutputGroupSettings']['Type'] == 'FILE_GROUP_SETTINGS':
-                    templateDestination = outputGroup['OutputGroupSettings']['FileGroupSettings']['Destination']
-                    templateDestinationKey = urlparse(templateDestination).path
-                    logger.info("templateDestinationKey == %s", templateDestinationKey)
-                    outputGroup['OutputGroupSettings']['FileGroupSettings']['Destination'] = destinationS3
-                else:
-                    logger.error("Exception: Unknown Output Group Type %s", outputGroup['OutputGroupSettings']['Type'])
-                    statusCode = 500
-                    
-            logger.info(json.dumps(jobSettings))
-
-            # Convert the video using AWS Elemental MediaConvert
-            job = client.create_job(Role=mediaConvertRole, UserMetadata=jobMetadata, Settings=jobSettings)
-
-        #full video
-        for j in jobsfull:
-            jobSettingsfull = j['settings']
-            jobFilenamefull = j['filename']
-
-            # Save the name of the settings file in the job userMetadata
-            jobMetadatafull['settings'] = jobFilenamefull
-
-            # Update the job settings with the source video from the S3 event
-            jobSettingsfull['Inputs'][0]['FileInput'] = templateS3URL
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][0]['ImageInserterInput'] = photopreview1
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][1]['ImageInserterInput'] = photopreview2
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][2]['ImageInserterInput'] = photopreview3
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][3]['ImageInserterInput'] = photopreview4
-            jobSettingsfull['Inputs'][0]['AudioSelectors']['Audio Selector 1']['ExternalAudioFileInput'] = audiofull
-            jobSettingsfull['Inputs'][0]['InputClippings'][0]['EndTimecode'] = fullvideolenght
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][0]['StartTime'] = "00:00:00:00"
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][1]['StartTime'] = imagetimefull1
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][2]['StartTime'] = imagetimefull2
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][3]['StartTime'] = imagetimefull3
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][0]['Duration'] = partial*1000
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][1]['Duration'] = partial*1000
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][2]['Duration'] = partial*1000
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][3]['Duration'] = partial*1000
-            jobSettingsfull['OutputGroups'][0]['Outputs'][0]['NameModifier'] = filename
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][0]['Width'] = 1100
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][1]['Width'] = 1100
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][2]['Width'] = 1100
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][3]['Width'] = 1100
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][0]['Height'] = 800
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][1]['Height'] = 800
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][2]['Height'] = 800
-            jobSettingsfull['Inputs'][0]['ImageInserter']['InsertableImages'][3]['Height'] = 800
-
-
-            # Update the job settings with the destination paths for converted videos.  We want to replace the
-            # destination bucket of the output paths in the job settings, but keep the rest of the
-            # path
-            destinationS3full = f"s3://{os.environ['DestinationBucket']}/output/full/hls/{filename}/"
-
-            for outputGroup in jobSettingsfull['OutputGroups']:
-
-                logger.info("outputGroup['OutputGroupSettings']['Type'] == %s", outputGroup['OutputGroupSettings']['Type'])
-
-                if outputGroup['OutputGroupSettings']['Type'] == 'HLS_GROUP_SETTINGS':
-                    templateDestination = outputGroup['OutputGroupSettings']['HlsGroupSettings']['Destination']
-                    templateDestinationKey = urlparse(templateDestination).path
-                    logger.info("templateDestinationKey == %s", templateDestinationKey)
-                    outputGroup['OutputGroupSettings']['HlsGroupSettings']['Destination'] = destinationS3full
-                else:
-                    logger.error("Exception: Unknown Output Group Type %s", outputGroup['OutputGroupSettings']['Type'])
-                    statusCode = 500
-                    
-            
-                    
-            logger.info(json.dumps(jobSettingsfull))
-
-            # Convert the video using AWS Elemental MediaConvert
-            jobfull = client.create_job(Role=mediaConvertRole, UserMetadata=jobMetadatafull, Settings=jobSettingsfull)
-
-    except Exception as e:
-        logger.error('Exception: %s', e)
-        statusCode = 500
+    # PREVIEW
+    # images keep the timings of the template, captions come from the scrape lambda
+    previewParams = job_settings.JobParameters(
+        file_input=templateS3URL_preview,
+        audio=audiopreview,
+        images=tuple(job_settings.ImageSlot(image) for image in photopreviews),
+        captions=f"s3://{sourceS3Bucket}/srt/preview/{article}.srt",
+        destination=f"s3://{os.environ['DestinationBucket']}/output/preview/{filename}"
+    )
+    
+    # FULL VIDEO
+    fullParams = job_settings.JobParameters(
+        file_input=templateS3URL,
+        audio=audiofull,
+        images=tuple(
+            job_settings.ImageSlot(image, start_time, duration)
+            for image, (start_time, duration) in zip(photos, imagetimesfull)
+            if duration > 0
+        ),
+        end_timecode=fullvideolenght,
+        name_modifier=filename,
+        destination=f"s3://{os.environ['DestinationBucket']}/output/full/hls/{filename}/"
+    )
 
-    finally:
-        return {
-            'statusCode': statusCode,
-            'body': json.dumps({"previewJob":job, "fullJob":jobfull}, indent=4, sort_keys=True, default=str)
+    return {
+        "previewJob": {
+            "Role": mediaConvertRole,
+            "UserMetadata": jobMetadata,
+            "Settings": job_settings.build(PREVIEW_TEMPLATE, previewParams)
+        },
+        "fullJob": {
+            "Role": mediaConvertRole,
+            "UserMetadata": jobMetadatafull,
+            "Settings": job_settings.build(FULL_TEMPLATE, fullParams)
         }
+    }
 
 # def create_media_tailor_jobs(event, context):
 
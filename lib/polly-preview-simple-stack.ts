@@ -9,6 +9,22 @@ import { Duration } from '@aws-cdk/core';
 
 const FFMPEG_PREVIEW_DURATION = "30";
 const FFMPEG_FADEOUT_DURATION = "3";
+const IMAGES_MAX_WORKERS = "8";
+// wav, aac, mp3 or flac: ImagesLambda is triggered by previews with this extension
+const PREVIEW_FORMAT = "wav";
+// pipe the preview straight to S3 instead of writing it to /tmp first, through a staging
+// prefix: only for formats that can be muxed to a pipe (aac, mp3), wav and flac always use /tmp
+const PREVIEW_STREAMING = "false";
+const IMAGE_SLOT_WIDTH = "1100";
+const IMAGE_SLOT_HEIGHT = "800";
+// images in the full narration video, MediaConvert inserts up to 20
+const IMAGES_MAX_COUNT = "4";
+// frame rate of the template videos, image timecodes are computed against it
+const VIDEO_FRAMERATE = "24";
+// renditions of the full video, by name from functions/video-lambda/ladder.json, all of them when empty
+const HLS_LADDER_RUNGS = "360p,540p,720p,1080p";
+// MB of /tmp the post-production functions use for records and cached overlays, out of 512
+const WORKSPACE_BUDGET_MB = "384";
 
 export class PollyPreviewSimpleStack extends cdk.Stack {
   constructor(scope: cdk.App, id: string, props?: cdk.StackProps) {
@@ -17,7 +33,15 @@ export class PollyPreviewSimpleStack extends cdk.Stack {
     const PollyAssetStore = new s3.Bucket(this, "PollyAssetStore", {
       enforceSSL: true,
       versioned: true,
-      encryption: s3.BucketEncryption.S3_MANAGED
+      encryption: s3.BucketEncryption.S3_MANAGED,
+      lifecycleRules: [
+        {
+          // streamed previews left behind by a failed copy, never notified to any function
+          prefix: "staging/",
+          expiration: Duration.days(1),
+          noncurrentVersionExpiration: Duration.days(1)
+        }
+      ]
     });
     const PollyMetadataStore = new dynamo.Table(this, "PollyMetadataStore", {
       partitionKey:{
@@ -113,15 +137,29 @@ export class PollyPreviewSimpleStack extends cdk.Stack {
       }
     });
     
+    // clients.py: boto3 clients shared by the Python functions, created on first use
+    const SharedLayer = new lambda.LayerVersion(this, "SharedLayer", {
+      code: lambda.Code.fromAsset("functions/shared-layer"),
+      compatibleRuntimes: [
+        lambda.Runtime.PYTHON_3_8
+      ]
+    });
+    
     const FadeOutLambda = new lambda.Function(this, "FadeOutLambda", {
       runtime: lambda.Runtime.PYTHON_3_8,
       code: lambda.Code.fromAsset("functions/postprod-lambda"),
       handler: "fadeout.handler",
+      layers: [SharedLayer],
       memorySize: 512,
       environment: {
         POLLY_METADATA_STORE : PollyMetadataStore.tableName,
         FFMPEG_PREVIEW_DURATION,
-        FFMPEG_FADEOUT_DURATION
+        FFMPEG_FADEOUT_DURATION,
+        // Polly narrations are constant bitrate mp3s, only the preview bytes are downloaded
+        FADEOUT_RANGED_DOWNLOAD: "true",
+        PREVIEW_FORMAT,
+        PREVIEW_STREAMING,
+        WORKSPACE_BUDGET_MB
       }
     });
     
@@ -129,10 +167,16 @@ export class PollyPreviewSimpleStack extends cdk.Stack {
       runtime: lambda.Runtime.PYTHON_3_8,
       code: lambda.Code.fromAsset("functions/postprod-lambda"),
       handler: "images.handler",
+      layers: [SharedLayer],
       timeout:  Duration.seconds(90),
       memorySize: 2048,
       environment: {
-        POLLY_METADATA_STORE : PollyMetadataStore.tableName
+        POLLY_METADATA_STORE : PollyMetadataStore.tableName,
+        IMAGES_MAX_WORKERS,
+        IMAGES_MAX_COUNT,
+        IMAGE_SLOT_WIDTH,
+        IMAGE_SLOT_HEIGHT,
+        WORKSPACE_BUDGET_MB
       }
     });
     
@@ -140,12 +184,22 @@ export class PollyPreviewSimpleStack extends cdk.Stack {
       runtime: lambda.Runtime.PYTHON_3_8,
       code: lambda.Code.fromAsset("functions/video-lambda"),
       handler: "video.handler",
+      layers: [SharedLayer],
+      // room for CreateJob retries and backoff, submit.py stops retrying before it runs out
+      timeout: Duration.seconds(30),
       memorySize: 512,
       environment: {
         POLLY_METADATA_STORE : PollyMetadataStore.tableName,
         DestinationBucket: PollyAssetStore.bucketName,
         Application: "VOD",
         MediaConvertRole: MediaconvertPassDownRole.roleArn,
+        IMAGE_SLOT_WIDTH,
+        IMAGE_SLOT_HEIGHT,
+        IMAGES_MAX_COUNT,
+        VIDEO_FRAMERATE,
+        HLS_LADDER_RUNGS,
+        // skips DescribeEndpoints altogether, get yours with `aws mediaconvert describe-endpoints`
+        // MEDIACONVERT_ENDPOINT: "https://abcd1234.mediaconvert.us-east-1.amazonaws.com",
         // TEMPLATE_S3_URL: "s3://your/custom/template/here.mp4",
         // TEMPLATE_S3_URL_PREVIEW: "s3://your/custom/template/here.mp4",
         TEMPLATE_S3_URL: `s3://${PollyAssetStore.bucketName}/custom/template/template.mov`,
@@ -157,6 +211,7 @@ export class PollyPreviewSimpleStack extends cdk.Stack {
       runtime: lambda.Runtime.PYTHON_3_8,
       code: lambda.Code.fromAsset("functions/finalize-lambda"),
       handler: "finalize.handler",
+      layers: [SharedLayer],
       memorySize: 512,
       environment: {
         POLLY_METADATA_STORE : PollyMetadataStore.tableName
@@ -200,7 +255,7 @@ export class PollyPreviewSimpleStack extends cdk.Stack {
           prefix: 'audio/preview'
         },
         {
-          suffix: 'wav'
+          suffix: PREVIEW_FORMAT
         }
       ]
     });
@@ -277,9 +332,13 @@ export class PollyPreviewSimpleStack extends cdk.Stack {
     PollyAssetStore.grantRead(ScrapeLambda);
     PollyAssetStore.grantRead(ImagesLambda);
     PollyAssetStore.grantRead(VideoLambda);
+    // playlists whose name doesn't tell master from child are probed
+    PollyAssetStore.grantRead(FinalizeUpdateLambda);
     
     PollyAssetStore.grantPut(PollyLambda);
     PollyAssetStore.grantPut(FadeOutLambda);
+    // streamed previews are staged under staging/ and deleted once copied to audio/preview
+    PollyAssetStore.grantDelete(FadeOutLambda);
     PollyAssetStore.grantPut(ScrapeLambda);
     PollyAssetStore.grantPut(ImagesLambda);
     PollyAssetStore.grantPut(VideoLambda);
@@ -0,0 +1,7 @@
+# The Python functions are imported through the bench fixtures, like Lambda imports them:
+# their own directory and the shared layer on the path, the stack's environment set.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
@@ -0,0 +1,38 @@
+import fixtures
+
+images = fixtures.load("images")
+
+def processed_media_object(uploaded):
+    # an article of four images, uploaded[i] tells whether image i made it to S3
+    media_object = images.create_media_object(["bench", "audio/preview/bench.json/narration.wav"])
+    media_object["images_urls"] = [f"https://example.com/{i}.jpg" for i in range(len(uploaded))]
+    media_object["article_body"] = {
+        "Text": "x" * 4000,
+        "ImagesURLs": media_object["images_urls"],
+        "ImagePositions": [0, 1000, 2000, 3000]
+    }
+    media_object["images"] = [
+        {"index": i, "url": url, "output_s3_path": f"s3://bench/image/{i}.tga" if ok else None}
+        for i, (url, ok) in enumerate(zip(media_object["images_urls"], uploaded))
+    ]
+    paths = [image["output_s3_path"] for image in media_object["images"] if image["output_s3_path"]]
+    media_object["metadata"] = {"Attributes": {"PostProducedImagesS3Paths": paths}}
+    return media_object
+
+def test_positions_follow_the_uploaded_images():
+    media_object = processed_media_object([True, False, True, True])
+    trigger = images.compact_trigger(media_object)
+    assert trigger["ArticleBody"]["ImagePositions"] == [0, 2000, 3000]
+    assert len(trigger["ArticleBody"]["ImagePositions"]) == len(trigger["Metadata"]["PostProducedImagesS3Paths"])
+
+def test_full_trigger_positions_follow_the_uploaded_images():
+    media_object = processed_media_object([True, False, True, True])
+    trigger = images.full_trigger(media_object)
+    assert trigger["ArticleBody"]["ImagePositions"] == [0, 2000, 3000]
+    # the article itself is left as scraped
+    assert media_object["article_body"]["ImagePositions"] == [0, 1000, 2000, 3000]
+
+def test_positions_that_dont_match_the_urls_are_dropped():
+    media_object = processed_media_object([True, True, True, True])
+    media_object["article_body"]["ImagePositions"] = [0, 1000]
+    assert "ArticleBody" not in images.compact_trigger(media_object)
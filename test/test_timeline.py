@@ -0,0 +1,22 @@
+import math
+
+import fixtures
+
+timeline = fixtures.load("video").timeline
+
+def start_seconds(slot, fps=timeline.VIDEO_FRAMERATE):
+    hours, minutes, seconds, frames = (int(part) for part in slot[0].split(":"))
+    return hours * 3600 + minutes * 60 + seconds + frames / fps
+
+def test_weights_include_the_text_before_the_first_image():
+    assert timeline.weights_from_positions([2000, 2500], 3000) == [2500, 500]
+
+def test_images_appear_when_their_text_is_narrated():
+    # the second image sits at 2500 of 3000 characters, 5/6 into the narration
+    slots = timeline.schedule(300, 2, timeline.weights_from_positions([2000, 2500], 3000))
+    assert start_seconds(slots[0]) == 0
+    assert start_seconds(slots[1]) == 250
+
+def test_slots_cover_the_whole_narration():
+    slots = timeline.schedule(187.4, 4, timeline.weights_from_positions([0, 900, 1800, 2700], 4000))
+    assert sum(duration for _, duration in slots) == round(math.ceil(187.4 * 24) * 1000 / 24)